@@ -0,0 +1,124 @@
+"""Cold-start benchmark: import time and time to first response per endpoint.
+
+Every sample runs in a fresh interpreter, so it pays the same module imports
+and client construction as a new Functions instance. Run from the project root:
+
+    python -m benchmarks.cold_start --runs 5
+    python -m benchmarks.cold_start --settings local.settings.json --endpoint prompt_create
+
+Without Cosmos settings only import time is measured. With ``--settings`` the
+values of a ``local.settings.json`` file are loaded first and each endpoint is
+called once; use a dedicated database, since the requests write data.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BENCH_USERNAME = "benchplayer"
+
+# Handler name -> (route, method, body) of a representative request
+ENDPOINTS = {
+    "player_register": ("player/register", "POST", {"username": BENCH_USERNAME, "password": "benchpass1"}),
+    "player_login": ("player/login", "GET", {"username": BENCH_USERNAME, "password": "benchpass1"}),
+    "player_update": ("player/update", "PUT",
+                      {"username": BENCH_USERNAME, "add_to_games_played": 1, "add_to_score": 10}),
+    "player_bulk_update": ("player/bulk_update", "PUT", {"players": [
+        {"username": BENCH_USERNAME, "add_to_games_played": 1, "add_to_score": 10}]}),
+    "prompt_create": ("prompt/create", "POST",
+                      {"text": "What is the best thing about cold starts?", "username": BENCH_USERNAME,
+                       "tags": ["bench"]}),
+    "prompt_bulk_create": ("prompt/bulk_create", "POST", {"prompts": [
+        {"text": f"What is the best thing about cold start {i}?", "username": BENCH_USERNAME, "tags": ["bench"]}
+        for i in range(10)]}),
+    "prompt_moderate": ("prompt/moderate", "POST", {"prompt-ids": [f"welcome-{BENCH_USERNAME}"]}),
+    "utils_get": ("utils/get", "GET", {"players": [BENCH_USERNAME], "tag_list": ["bench"]}),
+    "prompt_sample": ("prompt/sample", "GET", {"tag_list": ["bench"], "count": 5, "language": "en"}),
+    "utils_leaderboard": ("utils/leaderboard", "GET", {"top": 10, "username": BENCH_USERNAME}),
+    "utils_stats": ("utils/stats", "GET", {}),
+    "prompt_delete": ("prompt/delete", "POST", {"player": BENCH_USERNAME}),
+}
+
+
+def load_settings(path):
+    with open(path) as settings_file:
+        return json.load(settings_file).get("Values", {})
+
+
+def run_child(endpoint):
+    """Measure one cold start in this (fresh) interpreter and print the result as JSON."""
+    started = time.perf_counter()
+    import function_app
+    import_seconds = time.perf_counter() - started
+
+    result = {"import": import_seconds}
+    if endpoint:
+        import azure.functions as func
+
+        route, method, body = ENDPOINTS[endpoint]
+        request = func.HttpRequest(method, f"/{route}", body=json.dumps(body).encode("utf-8"))
+        handler = getattr(function_app, endpoint)
+
+        started = time.perf_counter()
+        response = asyncio.run(handler(request))
+        result["first_response"] = time.perf_counter() - started
+        result["status"] = response.status_code
+
+    print(json.dumps(result))
+
+
+def sample(endpoint, env):
+    command = [sys.executable, "-m", "benchmarks.cold_start", "--child"]
+    if endpoint:
+        command += ["--endpoint", endpoint]
+    output = subprocess.run(command, cwd=PROJECT_ROOT, env=env, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def summarize(label, values):
+    if not values:
+        return
+    print(f"  {label:<16} median {statistics.median(values) * 1000:8.1f} ms"
+          f"  min {min(values) * 1000:8.1f} ms  max {max(values) * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per endpoint")
+    parser.add_argument("--settings", help="local.settings.json to load app settings from")
+    parser.add_argument("--endpoint", action="append", choices=sorted(ENDPOINTS), help="endpoints to call")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.endpoint[0] if args.endpoint else None)
+        return
+
+    env = dict(os.environ)
+    if args.settings:
+        env.update(load_settings(args.settings))
+
+    endpoints = [None]
+    if env.get("AzureCosmosDBConnectionString"):
+        endpoints += args.endpoint or list(ENDPOINTS)
+    else:
+        print("AzureCosmosDBConnectionString not set, measuring import time only")
+
+    for endpoint in endpoints:
+        samples = [sample(endpoint, env) for _ in range(args.runs)]
+        print(endpoint or "import only")
+        summarize("import", [s["import"] for s in samples])
+        summarize("first response", [s["first_response"] for s in samples if "first_response" in s])
+        statuses = sorted({s["status"] for s in samples if "status" in s})
+        if statuses:
+            print(f"  status           {statuses}")
+
+
+if __name__ == "__main__":
+    main()
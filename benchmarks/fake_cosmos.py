@@ -0,0 +1,306 @@
+"""In-memory stand-in for the ``azure.cosmos.aio`` container API used by the app.
+
+Items live in a dict keyed by (partition key, id). Queries are not parsed:
+each query string the app sends is registered in ``QUERY_HANDLERS`` with a
+Python function that evaluates it against one item, so an unregistered query
+fails loudly instead of silently returning the wrong data.
+
+Every operation is counted in ``FakeContainer.calls``, can be delayed by a
+fixed latency to mimic a network round trip, and is charged request units from
+``REQUEST_CHARGES`` - a rough model of a small document, not the real numbers -
+which are also reported to ``shared_code.metrics`` like a real response would be.
+"""
+import asyncio
+import copy
+import time
+import uuid
+from collections import Counter
+from azure.core import MatchConditions
+from azure.cosmos import exceptions
+from shared_code import leaderboard, metrics, moderation, players, prompts
+
+# Request units per operation, or per item for read_items and batches
+REQUEST_CHARGES = {
+    "read": 1.0,
+    "read_item": 1.0,
+    "read_items": 1.0,
+    "create_item": 6.0,
+    "upsert_item": 6.0,
+    "replace_item": 6.0,
+    "delete_item": 6.0,
+    "patch_item": 10.0,
+    "execute_item_batch": 6.0,
+}
+
+# A query costs a fixed amount plus a little for every document it scans
+QUERY_BASE_CHARGE = 2.3
+QUERY_CHARGE_PER_SCANNED_ITEM = 0.05
+
+
+def _has_any_tag(item, params):
+    return any(tag in params["@tags"] for tag in item.get("tags_lower", []))
+
+
+def _prompt_by_players_and_tags(texts):
+    def handler(item, params):
+        if item.get("username") not in params["@players"] or not _has_any_tag(item, params):
+            return None
+        return {"id": item["id"], "username": item["username"], "texts": texts(item, params), "tags": item.get("tags")}
+    return handler
+
+
+QUERY_HANDLERS = {
+    players.PLAYER_EXISTS_QUERY:
+        lambda item, params: 1 if item["id"] == params["@username"] else None,
+    moderation.PROMPTS_BY_ID_QUERY:
+        lambda item, params: ({"id": item["id"], "texts": item.get("texts")}
+                              if item["id"] in params["@ids"] else None),
+    prompts.PROMPTS_BY_PLAYERS_AND_TAGS_QUERY.format(texts=prompts.ALL_TEXTS):
+        _prompt_by_players_and_tags(lambda item, params: item.get("texts")),
+    prompts.PROMPTS_BY_PLAYERS_AND_TAGS_QUERY.format(texts=prompts.LANGUAGE_TEXTS):
+        _prompt_by_players_and_tags(
+            lambda item, params: [t for t in item.get("texts", []) if t["language"] in params["@languages"]]),
+    leaderboard.TOP_PLAYERS_QUERY:
+        lambda item, params: {key: item.get(key, 0) for key in ("username", "total_score", "games_played")},
+    prompts.PROMPT_KEYS_BY_USERNAME_QUERY:
+        lambda item, params: ({"id": item["id"], "username": item["username"]}
+                              if item.get("username") == params["@username"] else None),
+}
+
+# Post-processing over all matches, for ORDER BY and TOP
+QUERY_FINALIZERS = {
+    leaderboard.TOP_PLAYERS_QUERY:
+        lambda results, params: sorted(results, key=lambda player: -player["total_score"])[:params["@count"]],
+}
+
+
+def _not_found(item_id):
+    return exceptions.CosmosResourceNotFoundError(status_code=404, message=f"Entity with id {item_id} not found")
+
+
+class _Page:
+    def __init__(self, items):
+        self._items = iter(items)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._items)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class _Pager:
+    """Async page iterator with an opaque offset continuation token."""
+
+    def __init__(self, query, continuation_token):
+        self._query = query
+        self._offset = int(continuation_token) if continuation_token else 0
+        self.continuation_token = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        results = await self._query._results()
+        if self._offset >= len(results):
+            raise StopAsyncIteration
+        page_size = self._query.max_item_count or len(results)
+        page = results[self._offset:self._offset + page_size]
+        self._offset += len(page)
+        self.continuation_token = str(self._offset) if self._offset < len(results) else None
+        return _Page(page)
+
+
+class _Query:
+    """Lazily evaluated query result supporting ``async for`` and ``by_page()``."""
+
+    def __init__(self, container, query, parameters, partition_key, max_item_count):
+        self.container = container
+        self.query = query
+        self.parameters = {p["name"]: p["value"] for p in parameters or []}
+        self.partition_key = partition_key
+        self.max_item_count = max_item_count
+        self._cached = None
+
+    async def _results(self):
+        if self._cached is None:
+            handler = QUERY_HANDLERS.get(self.query)
+            if handler is None:
+                raise NotImplementedError(f"FakeContainer has no handler for query: {self.query}")
+            results = []
+            scanned = 0
+            for (partition_key, _), item in list(self.container.items.items()):
+                if self.partition_key is not None and partition_key != self.partition_key:
+                    continue
+                scanned += 1
+                result = handler(item, self.parameters)
+                if result is not None:
+                    results.append(copy.deepcopy(result))
+            finalize = QUERY_FINALIZERS.get(self.query)
+            if finalize is not None:
+                results = finalize(results, self.parameters)
+            await self.container._operation("query", QUERY_BASE_CHARGE + QUERY_CHARGE_PER_SCANNED_ITEM * scanned)
+            self._cached = results
+        return self._cached
+
+    def by_page(self, continuation_token=None):
+        return _Pager(self, continuation_token)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for result in await self._results():
+            yield result
+
+
+class FakeContainer:
+    """In-memory container partitioned on ``partition_key_path``."""
+
+    def __init__(self, name, partition_key_path="/id", latency=0.0):
+        self.name = name
+        self.partition_key_path = partition_key_path
+        self.latency = latency
+        self.items = {}
+        self.calls = Counter()
+        self.request_charge = 0.0
+
+    def _partition_key(self, body):
+        return body[self.partition_key_path.lstrip("/")]
+
+    async def _operation(self, name, request_charge=None, count=1):
+        started = time.perf_counter()
+        self.calls[name] += 1
+        if request_charge is None:
+            request_charge = REQUEST_CHARGES[name] * count
+        self.request_charge += request_charge
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        metrics.record_cosmos(name, 200, request_charge, time.perf_counter() - started, path=f"/colls/{self.name}")
+
+    def _stored(self, body):
+        item = copy.deepcopy(body)
+        item["_etag"] = f'"{uuid.uuid4()}"'
+        item["_ts"] = int(time.time())
+        return item
+
+    def _get(self, item_id, partition_key):
+        try:
+            return self.items[(partition_key, item_id)]
+        except KeyError:
+            raise _not_found(item_id)
+
+    async def read(self, **kwargs):
+        await self._operation("read")
+        return {"id": self.name, "partitionKey": {"paths": [self.partition_key_path]}}
+
+    async def read_item(self, item, partition_key, **kwargs):
+        await self._operation("read_item")
+        return copy.deepcopy(self._get(item, partition_key))
+
+    async def read_items(self, items, **kwargs):
+        await self._operation("read_items", count=len(items))
+        return [copy.deepcopy(self.items[key[::-1]]) for key in items if key[::-1] in self.items]
+
+    def query_items(self, query, parameters=None, partition_key=None, max_item_count=None, **kwargs):
+        return _Query(self, query, parameters, partition_key, max_item_count)
+
+    async def create_item(self, body, **kwargs):
+        await self._operation("create_item")
+        key = (self._partition_key(body), body["id"])
+        if key in self.items:
+            raise exceptions.CosmosResourceExistsError(status_code=409, message=f"Entity with id {body['id']} exists")
+        self.items[key] = self._stored(body)
+        return copy.deepcopy(self.items[key])
+
+    async def upsert_item(self, body, **kwargs):
+        await self._operation("upsert_item")
+        key = (self._partition_key(body), body["id"])
+        self.items[key] = self._stored(body)
+        return copy.deepcopy(self.items[key])
+
+    async def replace_item(self, item, body, **kwargs):
+        await self._operation("replace_item")
+        item_id = item["id"] if isinstance(item, dict) else item
+        key = (self._partition_key(body), item_id)
+        stored = self._get(item_id, key[0])
+        if kwargs.get("match_condition") == MatchConditions.IfNotModified and kwargs.get("etag") != stored["_etag"]:
+            raise exceptions.CosmosAccessConditionFailedError(status_code=412, message="Precondition failed")
+        self.items[key] = self._stored(body)
+        return copy.deepcopy(self.items[key])
+
+    async def delete_item(self, item, partition_key, **kwargs):
+        await self._operation("delete_item")
+        item_id = item["id"] if isinstance(item, dict) else item
+        self._get(item_id, partition_key)
+        del self.items[(partition_key, item_id)]
+
+    async def patch_item(self, item, partition_key, patch_operations, **kwargs):
+        await self._operation("patch_item")
+        stored = copy.deepcopy(self._get(item, partition_key))
+        for operation in patch_operations:
+            _apply_patch(stored, operation)
+        self.items[(partition_key, item)] = self._stored(stored)
+        return copy.deepcopy(self.items[(partition_key, item)])
+
+    async def execute_item_batch(self, batch_operations, partition_key, **kwargs):
+        await self._operation("execute_item_batch", count=len(batch_operations))
+        # Transactional: validate every operation, against the effect of the ones before it, before applying any.
+        # Creates of an existing id fail with 409 and writes whose if_match_etag is stale with 412, as in Cosmos.
+        exists = {}
+        for index, (operation, args, *options) in enumerate(batch_operations):
+            item_id = args[0]["id"] if operation in ("create", "upsert") else args[0]
+            stored = self.items.get((partition_key, item_id))
+            found = exists.get(item_id, stored is not None)
+            etag = options[0].get("if_match_etag") if options else None
+            if operation in ("delete", "read", "replace", "patch") and not found:
+                status_code = 404
+            elif operation == "create" and found:
+                status_code = 409
+            elif etag is not None and (stored is None or item_id in exists or stored["_etag"] != etag):
+                status_code = 412
+            else:
+                exists[item_id] = operation != "delete"
+                continue
+            raise exceptions.CosmosBatchOperationError(
+                error_index=index, headers={}, status_code=status_code,
+                message=f"Operation {operation} on {item_id} failed",
+                operation_responses=[])
+        results = []
+        for operation, args, *_ in batch_operations:
+            if operation == "replace":
+                self.items[(partition_key, args[0])] = self._stored(args[1])
+                results.append({"statusCode": 200})
+            elif operation == "delete":
+                del self.items[(partition_key, args[0])]
+                results.append({"statusCode": 204})
+            elif operation in ("create", "upsert"):
+                self.items[(partition_key, args[0]["id"])] = self._stored(args[0])
+                results.append({"statusCode": 201})
+            else:
+                raise NotImplementedError(f"FakeContainer batches do not support {operation}")
+        return results
+
+
+def _apply_patch(document, operation):
+    *parents, field = operation["path"].strip("/").split("/")
+    target = document
+    for parent in parents:
+        target = target.setdefault(parent, {})
+
+    op = operation["op"]
+    if op == "incr":
+        target[field] = target.get(field, 0) + operation["value"]
+    elif op in ("set", "replace"):
+        target[field] = operation["value"]
+    elif op == "add":
+        if field == "-":
+            raise NotImplementedError("Use the array path itself when appending in FakeContainer")
+        target[field] = operation["value"]
+    elif op == "remove":
+        target.pop(field, None)
+    else:
+        raise NotImplementedError(f"FakeContainer does not support patch op {op}")
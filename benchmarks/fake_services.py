@@ -0,0 +1,112 @@
+"""Local fake Translator and Content Safety endpoints.
+
+Both services are served by one aiohttp app, so pointing ``TranslationEndpoint``
+and ``ContentSafetyEndpoint`` at it exercises the real ``ServiceClient`` code
+path: connection pooling, rate limiting and 429 retries. Run it on its own with
+
+    python -m benchmarks.fake_services --port 8900 --latency 0.05 --throttle-rate 0.1
+
+Translations are the source text prefixed with the target language, so HTML
+placeholders survive. Severities are derived from a hash of the text so the same
+text always gets the same result.
+"""
+import argparse
+import asyncio
+import hashlib
+import random
+from collections import Counter
+from aiohttp import web
+
+CONTENT_SAFETY_CATEGORIES = ["Hate", "SelfHarm", "Sexual", "Violence"]
+
+
+class FakeServices:
+    """Fake service state: injected latency, 429 rate and per-route call counts."""
+
+    def __init__(self, latency=0.0, throttle_rate=0.0, retry_after=0.1, seed=None):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self.throttled = Counter()
+        self._random = random.Random(seed)
+
+    async def _delay_or_throttle(self, name):
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.throttle_rate and self._random.random() < self.throttle_rate:
+            self.throttled[name] += 1
+            return web.json_response(
+                {"error": {"code": "429000", "message": "Too many requests"}},
+                status=429,
+                headers={"Retry-After": str(self.retry_after)})
+        return None
+
+    async def translate(self, request):
+        throttled = await self._delay_or_throttle("translate")
+        if throttled is not None:
+            return throttled
+
+        source_language = request.query.get("from")
+        targets = request.query.getall("to", [])
+        body = await request.json()
+        # Translator's request limits, with characters counted once per target language
+        if len(body) > 1000 or sum(len(item["text"]) for item in body) * len(targets) > 50000:
+            return web.json_response(
+                {"error": {"code": 400050, "message": "The input text is too long."}}, status=400)
+        results = []
+        for item in body:
+            result = {"translations": [{"text": f"[{target}] {item['text']}", "to": target} for target in targets]}
+            if source_language is None:
+                result["detectedLanguage"] = {"language": "en", "score": 1.0}
+            results.append(result)
+        return web.json_response(results)
+
+    async def analyze(self, request):
+        throttled = await self._delay_or_throttle("analyze")
+        if throttled is not None:
+            return throttled
+
+        body = await request.json()
+        digest = hashlib.sha256(body["text"].encode("utf-8")).digest()
+        # Content Safety reports severities 0, 2, 4 or 6 by default
+        return web.json_response({
+            "blocklistsMatch": [],
+            "categoriesAnalysis": [
+                {"category": category, "severity": (digest[i] % 4) * 2}
+                for i, category in enumerate(CONTENT_SAFETY_CATEGORIES)
+            ]
+        })
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post("/translate", self.translate)
+        app.router.add_post("/contentsafety/text:analyze", self.analyze)
+        return app
+
+    async def start(self, host="127.0.0.1", port=0):
+        """Serve on ``host:port`` (0 picks a free port); returns ``(runner, base_url)``."""
+        runner = web.AppRunner(self.app())
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        bound_port = site._server.sockets[0].getsockname()[1]
+        return runner, f"http://{host}:{bound_port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--retry-after", type=float, default=0.1, help="Retry-After sent with each 429")
+    args = parser.parse_args()
+
+    services = FakeServices(args.latency, args.throttle_rate, args.retry_after)
+    web.run_app(services.app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+"""Local load test: every route against in-memory Cosmos and fake AI services.
+
+Nothing leaves the machine. The Cosmos containers are replaced by
+``benchmarks.fake_cosmos.FakeContainer`` and the Translator and Content Safety
+endpoints point at ``benchmarks.fake_services``, so the app's own code - request
+handling, caching, batching, rate limiting and retries - is what gets measured.
+Run from the project root:
+
+    python -m benchmarks.load
+    python -m benchmarks.load --requests 500 --concurrency 50 --service-latency 0.05 --throttle-rate 0.1
+    python -m benchmarks.load --output baseline.json
+    python -m benchmarks.load --baseline baseline.json
+
+Each route runs as its own phase so database and external calls can be
+attributed to it. With ``--baseline`` the run fails (exit code 1) if any route
+makes more calls per request than the baseline, or its p95 latency grew by more
+than ``--tolerance``.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+
+SEED_PLAYERS = 200
+PROMPTS_PER_PLAYER = 5
+TAGS = ["science", "history", "music", "sport", "film"]
+PASSWORD = "benchpass1"
+
+
+def seed_username(i):
+    return f"player{i:05d}"
+
+
+class Route:
+    """One load phase: a handler plus a function building its i-th request."""
+
+    def __init__(self, name, handler, build):
+        self.name = name
+        self.handler = handler
+        self.build = build
+
+
+def http_request(route, method, body, headers=None):
+    import azure.functions as func
+
+    return func.HttpRequest(method, f"/api/{route}", body=json.dumps(body).encode("utf-8"), headers=headers)
+
+
+async def seed(player_container, prompt_container, rng):
+    from shared_code import players, prompts
+
+    for i in range(SEED_PLAYERS):
+        username = seed_username(i)
+        await players.create_player(player_container, username, PASSWORD)
+        for j in range(PROMPTS_PER_PLAYER):
+            tags = rng.sample(TAGS, 2)
+            await prompt_container.create_item(body={
+                "id": f"{username}-{j}",
+                "username": username,
+                "texts": [{"language": "en", "text": f"Seeded prompt {j} written by {username}"},
+                          {"language": "es", "text": f"[es] Seeded prompt {j} written by {username}"}],
+                "tags": tags,
+                "tags_lower": prompts.normalize_tags(tags)
+            })
+
+
+async def seed_deletable(prompt_container, count):
+    """Players whose prompts the prompt_delete phase removes, one player per request."""
+    for i in range(count):
+        for j in range(PROMPTS_PER_PLAYER):
+            await prompt_container.create_item(body={
+                "id": f"delete{i:05d}-{j}", "username": f"delete{i:05d}", "texts": [], "tags": [], "tags_lower": []})
+
+
+def build_routes(function_app, rng):
+    import azure.functions as func
+    from shared_code import auth
+
+    def random_player():
+        return seed_username(rng.randrange(SEED_PLAYERS))
+
+    def bearer(username):
+        return {"Authorization": f"Bearer {auth.issue_token(username)[0]}"}
+
+    def welcome_batch(i):
+        # A change-feed batch of ten new registrations
+        return func.DocumentList([
+            func.Document.from_dict({"id": f"new{i:05d}{j}", "username": f"new{i:05d}{j}",
+                                     "games_played": 0, "total_score": 0})
+            for j in range(10)
+        ])
+
+    return [
+        Route("player_register", function_app.player_register, lambda i: http_request(
+            "player/register", "POST", {"username": f"reg{i:06d}", "password": PASSWORD})),
+        Route("player_login", function_app.player_login, lambda i: http_request(
+            "player/login", "GET", {"username": random_player(), "password": PASSWORD})),
+        Route("player_update", function_app.player_update, lambda i: http_request(
+            "player/update", "PUT", {"username": random_player(), "add_to_games_played": 1, "add_to_score": 10})),
+        Route("player_bulk_update", function_app.player_bulk_update, lambda i: http_request(
+            "player/bulk_update", "PUT", {"players": [
+                {"username": random_player(), "add_to_games_played": 1, "add_to_score": 10} for _ in range(4)]})),
+        # One text in four repeats, so the translation cache sees some hits
+        Route("prompt_create", function_app.prompt_create, lambda i: http_request(
+            "prompt/create", "POST", {"text": f"What would you do with benchmark number {i if i % 4 else 0}?",
+                                      "username": random_player(), "tags": rng.sample(TAGS, 2)})),
+        # Every request is sent twice with the same key, like a client retrying after a timeout
+        Route("prompt_create_retry", function_app.prompt_create, lambda i: http_request(
+            "prompt/create", "POST", {"text": f"What would you do with retried benchmark {i // 2}?",
+                                      "username": seed_username(i // 2 % SEED_PLAYERS), "tags": ["retry"]},
+            {"Idempotency-Key": f"retry-{i // 2}"})),
+        # The same mix sent with a session token, which replaces the player existence check
+        Route("prompt_create_token", function_app.prompt_create, lambda i: http_request(
+            "prompt/create", "POST", {"text": f"What would you do with token benchmark {i if i % 4 else 0}?",
+                                      "username": (username := random_player()), "tags": rng.sample(TAGS, 2)},
+            bearer(username))),
+        # A 50-prompt pack per request, mostly new texts
+        Route("prompt_bulk_create", function_app.prompt_bulk_create, lambda i: http_request(
+            "prompt/bulk_create", "POST", {"prompts": [
+                {"text": f"Pack {i} question {j}: what is your favourite thing?", "username": random_player(),
+                 "tags": rng.sample(TAGS, 2)} for j in range(50)]})),
+        Route("prompt_moderate", function_app.prompt_moderate, lambda i: http_request(
+            "prompt/moderate", "POST", {"prompt-ids": [
+                f"{random_player()}-{rng.randrange(PROMPTS_PER_PLAYER)}" for _ in range(10)]})),
+        Route("utils_get", function_app.utils_get, lambda i: http_request(
+            "utils/get", "GET", {"players": [random_player() for _ in range(3)], "tag_list": rng.sample(TAGS, 2)})),
+        Route("utils_get_paged", function_app.utils_get, lambda i: http_request(
+            "utils/get", "GET", {"players": [random_player() for _ in range(20)], "tag_list": TAGS,
+                                 "page_size": 20, "languages": ["en"]})),
+        Route("prompt_sample", function_app.prompt_sample, lambda i: http_request(
+            "prompt/sample", "GET", {"tag_list": rng.sample(TAGS, 2), "count": 10, "language": "es"})),
+        Route("utils_leaderboard", function_app.utils_leaderboard, lambda i: http_request(
+            "utils/leaderboard", "GET", {"top": 10, "username": random_player()})),
+        Route("utils_stats", function_app.utils_stats, lambda i: http_request("utils/stats", "GET", {})),
+        Route("prompt_delete", function_app.prompt_delete, lambda i: http_request(
+            "prompt/delete", "POST", {"player": f"delete{i:05d}"})),
+        Route("utils_welcome", function_app.utils_welcome, welcome_batch),
+    ]
+
+
+async def run_phase(route, requests, concurrency):
+    """Send ``requests`` requests through ``route`` with at most ``concurrency`` in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    statuses = {}
+
+    async def one(i):
+        request = route.build(i)
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await route.handler(request)
+                # Triggers return nothing
+                status = response.status_code if response is not None else 200
+            except Exception:
+                # A failed trigger invocation, which the host would retry
+                status = "error"
+            latencies.append(time.perf_counter() - started)
+        statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return time.perf_counter() - started, latencies, statuses
+
+
+def percentiles(latencies):
+    if len(latencies) < 2:
+        value = latencies[0] if latencies else 0.0
+        return value, value, value
+    cut_points = statistics.quantiles(latencies, n=100, method="inclusive")
+    return cut_points[49], cut_points[94], cut_points[98]
+
+
+async def run(args):
+    # Read when shared_code is imported. Seeding hashes every password, and
+    # logins would otherwise measure PBKDF2 rather than the app
+    os.environ.setdefault("PasswordHashIterations", str(args.password_iterations))
+    os.environ.setdefault("SessionTokenSecret", "load-test-secret")
+
+    from benchmarks.fake_cosmos import FakeContainer
+    from benchmarks.fake_services import FakeServices
+
+    services = FakeServices(args.service_latency, args.throttle_rate, args.retry_after, seed=args.seed)
+    runner, base_url = await services.start()
+
+    # Must be set before the app builds its clients; rate limits are lifted so
+    # the app rather than the limiter is measured unless asked otherwise
+    os.environ["TranslationEndpoint"] = base_url
+    os.environ["ContentSafetyEndpoint"] = base_url
+    os.environ.setdefault("TranslationRateLimit", str(args.rate_limit))
+    os.environ.setdefault("ContentSafetyRateLimit", str(args.rate_limit))
+
+    import function_app
+    from shared_code import clients
+
+    player_container = FakeContainer("players", "/id")
+    prompt_container = FakeContainer("prompts", "/username")
+    clients._containers["PlayerContainerName"] = player_container
+    clients._containers["PromptContainerName"] = prompt_container
+    tag_index_container = FakeContainer("tag-index", "/tag")
+    clients._containers["TagIndexContainerName"] = tag_index_container
+    leaderboard_container = FakeContainer("leaderboard", "/board")
+    clients._containers["LeaderboardContainerName"] = leaderboard_container
+
+    # Seed without latency, then slow every operation the handlers make
+    rng = random.Random(args.seed)
+    await seed(player_container, prompt_container, rng)
+    await seed_deletable(prompt_container, args.requests)
+    # What the change-feed triggers would have built
+    await function_app.utils_tag_index([prompt for prompt in prompt_container.items.values()])
+    await function_app.utils_leaderboard_update([player for player in player_container.items.values()])
+    containers = [player_container, prompt_container, tag_index_container, leaderboard_container]
+    for container in containers:
+        container.latency = args.db_latency
+
+    results = {}
+    try:
+        for route in build_routes(function_app, rng):
+            if args.route and route.name not in args.route:
+                continue
+            db_before = sum(sum(container.calls.values()) for container in containers)
+            charge_before = sum(container.request_charge for container in containers)
+            external_before = sum(services.calls.values())
+
+            elapsed, latencies, statuses = await run_phase(route, args.requests, args.concurrency)
+
+            db_calls = sum(sum(container.calls.values()) for container in containers) - db_before
+            request_charge = sum(container.request_charge for container in containers) - charge_before
+            external_calls = sum(services.calls.values()) - external_before
+            p50, p95, p99 = percentiles(latencies)
+            results[route.name] = {
+                "requests": args.requests,
+                "throughput": args.requests / elapsed,
+                "p50_ms": p50 * 1000,
+                "p95_ms": p95 * 1000,
+                "p99_ms": p99 * 1000,
+                "db_calls_per_request": db_calls / args.requests,
+                "ru_per_request": request_charge / args.requests,
+                "external_calls_per_request": external_calls / args.requests,
+                "statuses": {str(status): count
+                             for status, count in sorted(statuses.items(), key=lambda item: str(item[0]))}
+            }
+    finally:
+        for client in clients._service_clients.values():
+            await client.close()
+        await runner.cleanup()
+
+    return results, dict(services.throttled)
+
+
+def print_results(results, throttled):
+    print(f"{'route':<20}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+          f"{'db/req':>9}{'RU/req':>9}{'ext/req':>9}  statuses")
+    for name, result in results.items():
+        print(f"{name:<20}{result['throughput']:>10.1f}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}"
+              f"{result['p99_ms']:>10.2f}{result['db_calls_per_request']:>9.2f}{result['ru_per_request']:>9.2f}"
+              f"{result['external_calls_per_request']:>9.2f}  {result['statuses']}")
+    if throttled:
+        print(f"429s injected: {throttled}")
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of regressions of ``results`` against ``baseline``."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]
+        for key in ("db_calls_per_request", "ru_per_request", "external_calls_per_request"):
+            if key not in before:
+                continue
+            # Small slack for the randomness in which texts hit the caches
+            if result[key] > before[key] + 0.01:
+                regressions.append(f"{name}: {key} {before[key]:.2f} -> {result[key]:.2f}")
+        if result["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {before['p95_ms']:.2f} ms -> {result['p95_ms']:.2f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=20, help="requests in flight per route")
+    parser.add_argument("--route", action="append", help="only run these routes")
+    parser.add_argument("--db-latency", type=float, default=0.002, help="seconds added to every Cosmos operation")
+    parser.add_argument("--service-latency", type=float, default=0.02, help="seconds added to every AI service call")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of AI service calls given a 429")
+    parser.add_argument("--retry-after", type=float, default=0.1, help="Retry-After sent with each 429")
+    parser.add_argument("--rate-limit", type=float, default=10000,
+                        help="client-side requests per second to each AI service, unless set in the environment")
+    parser.add_argument("--password-iterations", type=int, default=1000,
+                        help="PBKDF2 iterations for password hashes, unless set in the environment")
+    parser.add_argument("--seed", type=int, default=3207)
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--baseline", help="fail on regressions against this results file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative p95 increase")
+    args = parser.parse_args()
+
+    # Handlers log every 429 retry; keep the report readable
+    logging.basicConfig(level=logging.ERROR)
+
+    results, throttled = asyncio.run(run(args))
+    print_results(results, throttled)
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,63 @@
 import azure.functions as func
-import requests
+import asyncio
 import datetime
 import json
 import logging
 import os
-import uuid
-from azure.cosmos import CosmosClient
+from azure.cosmos import exceptions
+from shared_code import auth
+from shared_code import clients
+from shared_code import idempotency
+from shared_code import leaderboard
+from shared_code import metrics
+from shared_code import moderation
+from shared_code import players as player_repository
+from shared_code import prompts as prompt_repository
+from shared_code import tag_index
+from shared_code import translator
+from shared_code import welcome
+from shared_code.http_client import ServiceThrottledError
 
 app = func.FunctionApp()
 
-# Initialize Cosmos DB client
-cosmos_connection_string = os.environ.get("AzureCosmosDBConnectionString")
+# Only the names are read at import; clients are built lazily by shared_code.clients
 database_name = os.environ.get("DatabaseName")
 player_container_name = os.environ.get("PlayerContainerName")
 prompt_container_name = os.environ.get("PromptContainerName")
 
-# Create Cosmos client
-cosmos_client = CosmosClient.from_connection_string(cosmos_connection_string)
-database = cosmos_client.get_database_client(database_name)
-player_container = database.get_container_client(player_container_name)
-prompt_container = database.get_container_client(prompt_container_name)
+
+def throttled_response(error):
+    """503 telling the client when to retry after an external service throttled us."""
+    response = {
+        "result": False,
+        "msg": "Service busy, please retry later"
+    }
+    headers = {}
+    if error.retry_after is not None:
+        headers["Retry-After"] = str(int(error.retry_after + 0.999))
+    return func.HttpResponse(
+        json.dumps(response),
+        mimetype="application/json",
+        headers=headers,
+        status_code=503)
+
+
+def unauthorized_response():
+    """401 for a session token that is malformed, expired or issued to another player."""
+    response = {
+        "result": False,
+        "msg": "Invalid or expired session token"
+    }
+    return func.HttpResponse(
+        json.dumps(response),
+        mimetype="application/json",
+        status_code=401)
+
 
 @app.function_name(name="player_register")
 @app.route(route="player/register", methods=["POST"], auth_level=func.AuthLevel.FUNCTION)
-def player_register(req: func.HttpRequest) -> func.HttpResponse:
+@metrics.instrumented
+async def player_register(req: func.HttpRequest) -> func.HttpResponse:
     try:
         req_body = req.get_json()
         username = req_body["username"]
@@ -49,14 +83,10 @@ def player_register(req: func.HttpRequest) -> func.HttpResponse:
                 json.dumps(response),
                 mimetype="application/json")
 
-        # Check if username already exists
-        query = f"SELECT * FROM c WHERE c.username = '{username}'"
-        existing_players = list(player_container.query_items(
-            query=query,
-            enable_cross_partition_query=True
-        ))
-
-        if len(existing_players) > 0:
+        # Insert into Cosmos DB, keyed by username so duplicates are rejected
+        try:
+            await player_repository.create_player(clients.player_container(), username, password)
+        except exceptions.CosmosResourceExistsError:
             response = {
                 "result": False,
                 "msg": "Username already exists"
@@ -65,18 +95,6 @@ def player_register(req: func.HttpRequest) -> func.HttpResponse:
                 json.dumps(response),
                 mimetype="application/json")
 
-        # Create new player document with auto-generated ID
-        new_player = {
-            "id": str(uuid.uuid4()),  # Auto-generate unique ID
-            "username": username,
-            "password": password,
-            "games_played": 0,
-            "total_score": 0
-        }
-
-        # Insert into Cosmos DB
-        player_container.create_item(body=new_player)
-
         response = {
             "result": True,
             "msg": "OK"
@@ -99,26 +117,22 @@ def player_register(req: func.HttpRequest) -> func.HttpResponse:
 
 @app.function_name(name="player_login")
 @app.route(route="player/login", methods=["GET"], auth_level=func.AuthLevel.FUNCTION)
-def player_login(req: func.HttpRequest) -> func.HttpResponse:
+@metrics.instrumented
+async def player_login(req: func.HttpRequest) -> func.HttpResponse:
     try:
         req_body = req.get_json()
         username = req_body["username"]
         password = req_body["password"]
 
-        query = f"SELECT * FROM c WHERE c.username = '{username}'"
-
-        # Convert to list to check results
-        players = list(player_container.query_items(
-            query=query,
-            enable_cross_partition_query=True
-        ))
-
         # Check if player exists and password matches
-        if len(players) == 1 and players[0]["password"] == password:
+        if await player_repository.authenticate(clients.player_container(), username, password):
             response = {
                 "result": True,
                 "msg": "OK"
             }
+            # Later requests can present the token instead of being looked up again
+            if auth.tokens_enabled():
+                response["token"], response["expires_at"] = auth.issue_token(username)
         else:
             # Either player doesn't exist OR password is wrong
             response = {
@@ -143,21 +157,19 @@ def player_login(req: func.HttpRequest) -> func.HttpResponse:
 
 @app.function_name(name="player_update")
 @app.route(route="player/update", methods=["PUT"], auth_level=func.AuthLevel.FUNCTION)
-def player_update(req: func.HttpRequest) -> func.HttpResponse:
+@metrics.instrumented
+async def player_update(req: func.HttpRequest) -> func.HttpResponse:
     try:
         req_body = req.get_json()
         username = req_body["username"]
         add_to_games_played = req_body["add_to_games_played"]
         add_to_score = req_body["add_to_score"]
 
-        query = f"SELECT * FROM c WHERE c.username = '{username}'"
-
-        players = list(player_container.query_items(
-            query=query,
-            enable_cross_partition_query=True
-        ))
-
-        if len(players) == 0:
+        # Increment the counters server-side in a single round trip
+        try:
+            await player_repository.increment_stats(
+                clients.player_container(), username, add_to_games_played, add_to_score)
+        except exceptions.CosmosResourceNotFoundError:
             response = {
                 "result": False,
                 "msg": "Player does not exist"
@@ -166,14 +178,6 @@ def player_update(req: func.HttpRequest) -> func.HttpResponse:
                 json.dumps(response),
                 mimetype="application/json")
 
-        # Player exists, update the values
-        player = players[0]
-        player["games_played"] += add_to_games_played
-        player["total_score"] += add_to_score
-
-        # Replace the item in Cosmos DB
-        player_container.replace_item(item=player, body=player)
-
         response = {
             "result": True,
             "msg": "OK"
@@ -194,9 +198,59 @@ def player_update(req: func.HttpRequest) -> func.HttpResponse:
             status_code=500)
 
 
+@app.function_name(name="player_bulk_update")
+@app.route(route="player/bulk_update", methods=["PUT"], auth_level=func.AuthLevel.FUNCTION)
+@metrics.instrumented
+async def player_bulk_update(req: func.HttpRequest) -> func.HttpResponse:
+    try:
+        req_body = req.get_json()
+        updates = req_body["players"]
+
+        async def apply_update(update):
+            username = update["username"]
+            try:
+                await player_repository.increment_stats(
+                    clients.player_container(),
+                    username,
+                    update["add_to_games_played"],
+                    update["add_to_score"])
+                return {"username": username, "result": True, "msg": "OK"}
+            except exceptions.CosmosResourceNotFoundError:
+                return {"username": username, "result": False, "msg": "Player does not exist"}
+            except Exception as e:
+                logging.error(f"Error updating {username} in player_bulk_update: {str(e)}")
+                return {"username": username, "result": False, "msg": f"Error: {str(e)}"}
+
+        # Patch every player in the finished game concurrently
+        results = await asyncio.gather(*(apply_update(update) for update in updates))
+
+        updated_count = sum(1 for result in results if result["result"])
+        response = {
+            "result": updated_count == len(results),
+            "msg": f"{updated_count} players updated",
+            "players": results
+        }
+        return func.HttpResponse(
+            json.dumps(response),
+            mimetype="application/json")
+
+    except Exception as e:
+        logging.error(f"Error in player_bulk_update: {str(e)}")
+        response = {
+            "result": False,
+            "msg": f"Error: {str(e)}"
+        }
+        return func.HttpResponse(
+            json.dumps(response),
+            mimetype="application/json",
+            status_code=500)
+
+
 @app.function_name(name="prompt_create")
 @app.route(route="prompt/create", methods=["POST"], auth_level=func.AuthLevel.FUNCTION)
-def prompt_create(req: func.HttpRequest) -> func.HttpResponse:
+@metrics.instrumented
+@idempotency.idempotent(clients.idempotency_cache)
+async def prompt_create(req: func.HttpRequest) -> func.HttpResponse:
     try:
         req_body = req.get_json()
         text = req_body["text"]
@@ -213,41 +267,46 @@ def prompt_create(req: func.HttpRequest) -> func.HttpResponse:
                 json.dumps(response),
                 mimetype="application/json")
 
-        # Check if player exists
-        query = f"SELECT * FROM c WHERE c.username = '{username}'"
-        players = list(player_container.query_items(
-            query=query,
-            enable_cross_partition_query=True
-        ))
+        # A session token issued to this player proves it exists without a database read
+        token = auth.bearer_token(req.headers)
+        if token is not None and auth.verify_token(token) != username:
+            return unauthorized_response()
 
-        if len(players) == 0:
+        # A resent prompt maps to the stored one, so it is answered before any translation
+        prompt_id = prompt_repository.prompt_id(username, text)
+        if await prompt_repository.prompt_exists(clients.prompt_container(), prompt_id, username):
             response = {
-                "result": False,
-                "msg": "Player does not exist"
+                "result": True,
+                "msg": "OK",
+                "id": prompt_id
             }
             return func.HttpResponse(
                 json.dumps(response),
                 mimetype="application/json")
 
+        # Check if player exists while the language is detected and translated
+        translation_task = asyncio.create_task(
+            translator.cached_detect_and_translate(clients.translator_client(), text, clients.translation_cache()))
 
-        translation_endpoint = os.environ.get("TranslationEndpoint")
-        translation_key = os.environ.get("TranslationKey")
-        translation_region = os.environ.get("TranslationRegion", "italynorth")  # Default to italynorth
-
-        # Detect language
-        detect_url = f"{translation_endpoint}/detect?api-version=3.0"
-        detect_headers = {
-            'Ocp-Apim-Subscription-Key': translation_key,
-            'Ocp-Apim-Subscription-Region': translation_region,
-            'Content-type': 'application/json'
-        }
-        detect_body = [{'text': text}]
+        try:
+            player_found = token is not None or await player_repository.player_exists(
+                clients.player_container(), username)
+        except BaseException:
+            # Stop paying for a translation nobody will use
+            translation_task.cancel()
+            raise
 
-        detect_response = requests.post(detect_url, headers=detect_headers, json=detect_body)
-        detect_result = detect_response.json()
+        if not player_found:
+            translation_task.cancel()
+            response = {
+                "result": False,
+                "msg": "Player does not exist"
+            }
+            return func.HttpResponse(
+                json.dumps(response),
+                mimetype="application/json")
 
-        detected_language = detect_result[0]['language']
-        confidence = detect_result[0]['score']
+        detected_language, confidence, translations = await translation_task
 
         # Check language confidence
         if confidence < 0.2:
@@ -259,50 +318,29 @@ def prompt_create(req: func.HttpRequest) -> func.HttpResponse:
                 json.dumps(response),
                 mimetype="application/json")
 
-        # Supported languages: English (en), Welsh (cy), Spanish (es), Tamil (ta), Chinese Simplified (zh-Hans), Arabic (ar)
-        supported_languages = ['en', 'cy', 'es', 'ta', 'zh-Hans', 'ar']
+        texts = translator.build_texts(text, detected_language, translations)
 
+        prompt_doc = prompt_repository.new_prompt(username, texts, tags)
 
-        texts = [{"text": text, "language": detected_language}]
-
-        # Translate to all other supported languages
-        for target_lang in supported_languages:
-            if target_lang != detected_language:
-                translate_url = f"{translation_endpoint}/translate?api-version=3.0&from={detected_language}&to={target_lang}"
-                translate_headers = {
-                    'Ocp-Apim-Subscription-Key': translation_key,
-                    'Ocp-Apim-Subscription-Region': translation_region,
-                    'Content-type': 'application/json'
-                }
-                translate_body = [{'text': text}]
-
-                translate_response = requests.post(translate_url, headers=translate_headers, json=translate_body)
-                translate_result = translate_response.json()
-
-                translated_text = translate_result[0]['translations'][0]['text']
-                texts.append({"text": translated_text, "language": target_lang})
-
-
-        unique_tags = list(dict.fromkeys(tags))
-
-        prompt_doc = {
-            "id": str(uuid.uuid4()),  # Auto-generate unique ID
-            "username": username,
-            "texts": texts,
-            "tags": unique_tags
-        }
-
-       
-        prompt_container.create_item(body=prompt_doc)
+        try:
+            await clients.prompt_container().create_item(body=prompt_doc)
+        except exceptions.CosmosResourceExistsError:
+            # A concurrent retry stored the same prompt first
+            pass
 
         response = {
             "result": True,
-            "msg": "OK"
+            "msg": "OK",
+            "id": prompt_doc["id"]
         }
         return func.HttpResponse(
             json.dumps(response),
             mimetype="application/json")
 
+    except ServiceThrottledError as e:
+        logging.warning(f"Throttled in prompt_create: {str(e)}")
+        return throttled_response(e)
+
     except Exception as e:
         logging.error(f"Error in prompt_create: {str(e)}")
         response = {
@@ -315,77 +353,157 @@ def prompt_create(req: func.HttpRequest) -> func.HttpResponse:
             status_code=500)
 
 
-
-@app.function_name(name="prompt_moderate")
-@app.route(route="prompt/moderate", methods=["POST"], auth_level=func.AuthLevel.FUNCTION)
-def prompt_moderate(req: func.HttpRequest) -> func.HttpResponse:
+@app.function_name(name="prompt_bulk_create")
+@app.route(route="prompt/bulk_create", methods=["POST"], auth_level=func.AuthLevel.FUNCTION)
+@metrics.instrumented
+@idempotency.idempotent(clients.idempotency_cache)
+async def prompt_bulk_create(req: func.HttpRequest) -> func.HttpResponse:
     try:
         req_body = req.get_json()
-        prompt_ids = req_body["prompt-ids"]
-
-        content_safety_endpoint = os.environ.get("ContentSafetyEndpoint")
-        content_safety_key = os.environ.get("ContentSafetyKey")
-
-        results = []
-
-        for prompt_id in prompt_ids:
-            # Query for the prompt by ID
-            query = f"SELECT * FROM c WHERE c.id = '{prompt_id}'"
-            prompts = list(prompt_container.query_items(
-                query=query,
-                enable_cross_partition_query=True
-            ))
-
-            # If prompt doesn't exist, skip it
-            if len(prompts) == 0:
-                continue
+        items = req_body["prompts"]
 
-            prompt = prompts[0]
-
-            # Get the English text from the prompt
-            english_text = None
-            for text_obj in prompt["texts"]:
-                if text_obj["language"] == "en":
-                    english_text = text_obj["text"]
-                    break
+        if len(items) > prompt_repository.MAX_BULK_CREATE:
+            response = {
+                "result": False,
+                "msg": f"At most {prompt_repository.MAX_BULK_CREATE} prompts per request"
+            }
+            return func.HttpResponse(
+                json.dumps(response),
+                mimetype="application/json")
 
-            if not english_text:
+        # A session token only allows prompts for the player it was issued to, and skips their existence check
+        token = auth.bearer_token(req.headers)
+        token_username = auth.verify_token(token) if token is not None else None
+        if token is not None and (token_username is None or any(
+                isinstance(item, dict) and item.get("username", token_username) != token_username
+                for item in items)):
+            return unauthorized_response()
+
+        results = [None] * len(items)
+
+        def reject(index, msg):
+            results[index] = {"index": index, "result": False, "msg": msg}
+
+        # Malformed items are rejected on their own, before anything is translated
+        valid = []
+        for index, item in enumerate(items):
+            if not isinstance(item, dict) or not isinstance(item.get("text"), str) \
+                    or not isinstance(item.get("username"), str) or not isinstance(item.get("tags"), list) \
+                    or not all(isinstance(tag, str) for tag in item["tags"]):
+                reject(index, "Prompt needs a text, a username and a list of tags")
+            # Same length rule as prompt/create
+            elif len(item["text"]) < 20 or len(item["text"]) > 120:
+                reject(index, "Prompt less than 20 characters or more than 120 characters")
+            else:
+                valid.append(index)
+
+        # Check each distinct player once, before paying for any translation
+        usernames = [
+            username for username in dict.fromkeys(items[index]["username"] for index in valid)
+            if username != token_username
+        ]
+        exists = await asyncio.gather(*(
+            player_repository.player_exists(clients.player_container(), username) for username in usernames
+        ))
+        existing_usernames = {username for username, found in zip(usernames, exists) if found}
+        if token_username is not None:
+            existing_usernames.add(token_username)
+        for index in valid:
+            if items[index]["username"] not in existing_usernames:
+                reject(index, "Player does not exist")
+        valid = [index for index in valid if results[index] is None]
+
+        # Prompts already stored, or repeated in this request, need no translation or insert
+        prompt_ids = {index: prompt_repository.prompt_id(items[index]["username"], items[index]["text"])
+                      for index in valid}
+        first_index_by_id = {}
+        for index in valid:
+            first_index_by_id.setdefault(prompt_ids[index], index)
+        stored_ids = await prompt_repository.existing_ids(
+            clients.prompt_container(), [(prompt_id, items[index]["username"])
+                                         for prompt_id, index in first_index_by_id.items()])
+        for index in valid:
+            if prompt_ids[index] in stored_ids:
+                results[index] = {"index": index, "result": True, "msg": "OK", "id": prompt_ids[index]}
+        valid = [index for index in valid if results[index] is None and first_index_by_id[prompt_ids[index]] == index]
+
+        # Detect and translate every text in array requests of up to 100 texts
+        detections = await translator.cached_detect_and_translate_many(
+            clients.translator_client(), [items[index]["text"] for index in valid], clients.translation_cache())
+
+        to_create = []
+        prompt_docs = []
+        for index, (detected_language, confidence, translations) in zip(valid, detections):
+            if confidence < 0.2:
+                reject(index, "Unsupported language")
                 continue
+            item = items[index]
+            texts = translator.build_texts(item["text"], detected_language, translations)
+            to_create.append(index)
+            prompt_docs.append(prompt_repository.new_prompt(item["username"], texts, item["tags"]))
+
+        errors = await prompt_repository.create_many(clients.prompt_container(), prompt_docs)
+
+        for index, prompt_doc, error in zip(to_create, prompt_docs, errors):
+            # A conflict means a concurrent request stored the same prompt first
+            if error is None or isinstance(error, exceptions.CosmosResourceExistsError):
+                results[index] = {"index": index, "result": True, "msg": "OK", "id": prompt_doc["id"]}
+            else:
+                logging.error(f"Error creating prompt {index} in prompt_bulk_create: {str(error)}")
+                reject(index, f"Error: {str(error)}")
+
+        # Repeats within the request share the outcome of their first occurrence
+        for index, prompt_id in prompt_ids.items():
+            if results[index] is None:
+                results[index] = {**results[first_index_by_id[prompt_id]], "index": index}
+
+        created_count = sum(1 for result in results if result["result"])
+        response = {
+            "result": created_count == len(results),
+            "msg": f"{created_count} prompts created",
+            "prompts": results
+        }
+        return func.HttpResponse(
+            json.dumps(response),
+            mimetype="application/json")
 
-            # Call Content Safety API
-            moderate_url = f"{content_safety_endpoint}contentsafety/text:analyze?api-version=2023-10-01"
-            moderate_headers = {
-                'Ocp-Apim-Subscription-Key': content_safety_key,
-                'Content-Type': 'application/json'
-            }
-            moderate_body = {
-                "text": english_text
-            }
+    except ServiceThrottledError as e:
+        logging.warning(f"Throttled in prompt_bulk_create: {str(e)}")
+        return throttled_response(e)
 
-            moderate_response = requests.post(moderate_url, headers=moderate_headers, json=moderate_body)
-            moderate_result = moderate_response.json()
-            
-            # Extract severity scores from the 4 categories
-            categories = moderate_result.get("categoriesAnalysis", [])
-            severities = [cat["severity"] for cat in categories]
+    except Exception as e:
+        logging.error(f"Error in prompt_bulk_create: {str(e)}")
+        response = {
+            "result": False,
+            "msg": f"Error: {str(e)}"
+        }
+        return func.HttpResponse(
+            json.dumps(response),
+            mimetype="application/json",
+            status_code=500)
 
-            average_severity = sum(severities) / len(severities) if severities else 0
 
-            outcome = average_severity > 2
 
-            # Round to 2 decimal places for consistency
-            average_severity = round(average_severity, 2)
+@app.function_name(name="prompt_moderate")
+@app.route(route="prompt/moderate", methods=["POST"], auth_level=func.AuthLevel.FUNCTION)
+@metrics.instrumented
+async def prompt_moderate(req: func.HttpRequest) -> func.HttpResponse:
+    try:
+        req_body = req.get_json()
+        prompt_ids = req_body["prompt-ids"]
 
-            results.append({
-                "prompt-id": prompt_id,
-                "outcome": outcome,
-                "average_severity": average_severity
-            })
+        # Fetch every prompt in one query and moderate distinct texts concurrently
+        results = await moderation.moderate(
+            clients.prompt_container(), clients.content_safety_client(), prompt_ids, clients.moderation_cache())
 
         return func.HttpResponse(
             json.dumps(results),
             mimetype="application/json")
 
+    except ServiceThrottledError as e:
+        logging.warning(f"Throttled in prompt_moderate: {str(e)}")
+        return throttled_response(e)
+
     except Exception as e:
         logging.error(f"Error in prompt_moderate: {str(e)}")
         response = {
@@ -400,26 +518,25 @@ def prompt_moderate(req: func.HttpRequest) -> func.HttpResponse:
 
 @app.function_name(name="prompt_delete")
 @app.route(route="prompt/delete", methods=["POST"], auth_level=func.AuthLevel.FUNCTION)
-def prompt_delete(req: func.HttpRequest) -> func.HttpResponse:
+@metrics.instrumented
+async def prompt_delete(req: func.HttpRequest) -> func.HttpResponse:
     try:
         req_body = req.get_json()
         player = req_body["player"]
 
-        # Query for all prompts by this player
-        query = f"SELECT * FROM c WHERE c.username = '{player}'"
-        prompts_to_delete = list(prompt_container.query_items(
-            query=query,
-            enable_cross_partition_query=True
-        ))
+        # Delete in pages of ids using per-partition transactional batches
+        deleted_count, failed_count = await prompt_repository.delete_by_username(clients.prompt_container(), player)
 
-        # Delete each prompt
-        deleted_count = 0
-        for prompt in prompts_to_delete:
-            prompt_container.delete_item(
-                item=prompt["id"],
-                partition_key=prompt["username"]
-            )
-            deleted_count += 1
+        if failed_count > 0:
+            response = {
+                "result": False,
+                "msg": f"{deleted_count} prompts deleted, {failed_count} failed; retry to resume",
+                "deleted": deleted_count
+            }
+            return func.HttpResponse(
+                json.dumps(response),
+                mimetype="application/json",
+                status_code=500)
 
         response = {
             "result": True,
@@ -441,32 +558,91 @@ def prompt_delete(req: func.HttpRequest) -> func.HttpResponse:
             status_code=500)
 
 
+@app.function_name(name="prompt_sample")
+@app.route(route="prompt/sample", methods=["GET"], auth_level=func.AuthLevel.FUNCTION)
+@metrics.instrumented
+async def prompt_sample(req: func.HttpRequest) -> func.HttpResponse:
+    try:
+        req_body = req.get_json()
+        tag_list = req_body["tag_list"]
+        count = req_body["count"]
+        language = req_body.get("language", "en")
+
+        if count < 1 or count > tag_index.MAX_SAMPLE_SIZE:
+            response = {
+                "result": False,
+                "msg": f"Count less than 1 or more than {tag_index.MAX_SAMPLE_SIZE}"
+            }
+            return func.HttpResponse(
+                json.dumps(response),
+                mimetype="application/json")
+
+        if language not in translator.SUPPORTED_LANGUAGES:
+            response = {
+                "result": False,
+                "msg": "Unsupported language"
+            }
+            return func.HttpResponse(
+                json.dumps(response),
+                mimetype="application/json")
+
+        # Sample from the tag index instead of querying every matching prompt
+        results = await tag_index.sample(
+            clients.prompt_container(),
+            clients.tag_index_container(),
+            clients.tag_index_cache(),
+            tag_list,
+            count,
+            language)
+
+        return func.HttpResponse(
+            json.dumps(results),
+            mimetype="application/json")
+
+    except Exception as e:
+        logging.error(f"Error in prompt_sample: {str(e)}")
+        response = {
+            "result": False,
+            "msg": f"Error: {str(e)}"
+        }
+        return func.HttpResponse(
+            json.dumps(response),
+            mimetype="application/json",
+            status_code=500)
+
+
 @app.function_name(name="utils_get")
 @app.route(route="utils/get", methods=["GET"], auth_level=func.AuthLevel.FUNCTION)
-def utils_get(req: func.HttpRequest) -> func.HttpResponse:
+@metrics.instrumented
+async def utils_get(req: func.HttpRequest) -> func.HttpResponse:
     try:
         req_body = req.get_json()
         players = req_body["players"]
         tag_list = req_body["tag_list"]
 
-        # Convert tag_list to lowercase for case-insensitive comparison
-        tag_list_lower = [tag.lower() for tag in tag_list]
+        languages = req_body.get("languages")
 
-        results = []
+        # Opt-in paged mode returns one page plus a token for the next one
+        if "page_size" in req_body:
+            prompts, continuation = await prompt_repository.find_page_by_players_and_tags(
+                clients.prompt_container(),
+                players,
+                tag_list,
+                req_body["page_size"],
+                continuation=req_body.get("continuation"),
+                languages=languages)
 
-        # Query for all prompts by the specified players
-        for player in players:
-            query = f"SELECT * FROM c WHERE c.username = '{player}'"
-            prompts = list(prompt_container.query_items(
-                query=query,
-                enable_cross_partition_query=True
-            ))
+            response = {
+                "prompts": prompts,
+                "continuation": continuation
+            }
+            return func.HttpResponse(
+                json.dumps(response),
+                mimetype="application/json")
 
-            # Filter prompts that have at least one matching tag
-            for prompt in prompts:
-                prompt_tags_lower = [tag.lower() for tag in prompt.get("tags", [])]
-                if any(tag in tag_list_lower for tag in prompt_tags_lower):
-                    results.append(prompt)
+        # Filter on players and case-insensitive tags in a single query
+        results = await prompt_repository.find_by_players_and_tags(
+            clients.prompt_container(), players, tag_list, languages)
 
         return func.HttpResponse(
             json.dumps(results),
@@ -484,6 +660,78 @@ def utils_get(req: func.HttpRequest) -> func.HttpResponse:
             status_code=500)
 
 
+@app.function_name(name="utils_stats")
+@app.route(route="utils/stats", methods=["GET"], auth_level=func.AuthLevel.FUNCTION)
+@metrics.instrumented
+async def utils_stats(req: func.HttpRequest) -> func.HttpResponse:
+    try:
+        # Hit/miss counters of this instance's caches
+        response = {
+            "translation_cache": clients.translation_cache().stats(),
+            "moderation_cache": clients.moderation_cache().stats()
+        }
+        return func.HttpResponse(
+            json.dumps(response),
+            mimetype="application/json")
+
+    except Exception as e:
+        logging.error(f"Error in utils_stats: {str(e)}")
+        response = {
+            "result": False,
+            "msg": f"Error: {str(e)}"
+        }
+        return func.HttpResponse(
+            json.dumps(response),
+            mimetype="application/json",
+            status_code=500)
+
+
+@app.function_name(name="utils_leaderboard")
+@app.route(route="utils/leaderboard", methods=["GET"], auth_level=func.AuthLevel.FUNCTION)
+@metrics.instrumented
+async def utils_leaderboard(req: func.HttpRequest) -> func.HttpResponse:
+    try:
+        req_body = req.get_json()
+        count = req_body.get("top", 10)
+        username = req_body.get("username")
+
+        if count < 1 or count > leaderboard.MAX_TOP:
+            response = {
+                "result": False,
+                "msg": f"Top less than 1 or more than {leaderboard.MAX_TOP}"
+            }
+            return func.HttpResponse(
+                json.dumps(response),
+                mimetype="application/json")
+
+        # Read the change-feed maintained leaderboard instead of scanning players
+        top, player = await leaderboard.get_leaderboard(
+            clients.leaderboard_container(),
+            clients.player_container(),
+            clients.leaderboard_cache(),
+            count,
+            username)
+
+        response = {
+            "top": top,
+            "player": player
+        }
+        return func.HttpResponse(
+            json.dumps(response),
+            mimetype="application/json")
+
+    except Exception as e:
+        logging.error(f"Error in utils_leaderboard: {str(e)}")
+        response = {
+            "result": False,
+            "msg": f"Error: {str(e)}"
+        }
+        return func.HttpResponse(
+            json.dumps(response),
+            mimetype="application/json",
+            status_code=500)
+
+
 @app.function_name(name="utils_welcome")
 @app.cosmos_db_trigger(arg_name="documents",
                        database_name=database_name,
@@ -491,79 +739,87 @@ def utils_get(req: func.HttpRequest) -> func.HttpResponse:
                        connection="AzureCosmosDBConnectionString",
                        lease_container_name="leases",
                        create_lease_container_if_not_exists=True)
-def utils_welcome(documents: func.DocumentList) -> None:
+@app.retry(strategy="exponential_backoff", max_retry_count="5",
+           minimum_interval="00:00:02", maximum_interval="00:01:00")
+@metrics.instrumented
+async def utils_welcome(documents: func.DocumentList) -> None:
     try:
-        translation_endpoint = os.environ.get("TranslationEndpoint")
-        translation_key = os.environ.get("TranslationKey")
-        translation_region = os.environ.get("TranslationRegion", "italynorth")
-
-        for doc in documents:
-            # Check if this is a new player registration (games_played == 0 and total_score == 0)
-            if doc.get("games_played") == 0 and doc.get("total_score") == 0:
-                username = doc.get("username")
-
-                # Check if a welcome prompt already exists for this user
-                try:
-                    welcome_check_query = f"SELECT * FROM c WHERE c.username = '{username}'"
-                    existing_prompts = list(prompt_container.query_items(
-                        query=welcome_check_query,
-                        enable_cross_partition_query=True
-                    ))
-
-                    # Filter to check for welcome messages (empty tags and contains welcome text)
-                    existing_welcome = []
-                    for p in existing_prompts:
-                        if len(p.get('tags', [])) == 0:
-                            for text_obj in p.get('texts', []):
-                                if 'welcome to comp3207' in text_obj.get('text', '').lower():
-                                    existing_welcome.append(p)
-                                    break
-
-                    # Skip if welcome already exists
-                    if len(existing_welcome) > 0:
-                        logging.info(f"Welcome prompt already exists for user: {username}, skipping creation")
-                        continue
-                except Exception as check_error:
-                    logging.warning(f"Error checking for existing welcome prompt: {str(check_error)}")
-                    # Continue to create welcome even if check fails
-
-                welcome_text = f"Welcome to COMP3207, {username}"
-
-                supported_languages = ['en', 'cy', 'es', 'ta', 'zh-Hans', 'ar']
-
-                # Start with English
-                texts = [{"text": welcome_text, "language": "en"}]
-
-                # Translate to all other supported languages
-                for target_lang in supported_languages:
-                    if target_lang != "en":
-                        translate_url = f"{translation_endpoint}/translate?api-version=3.0&from=en&to={target_lang}"
-                        translate_headers = {
-                            'Ocp-Apim-Subscription-Key': translation_key,
-                            'Ocp-Apim-Subscription-Region': translation_region,
-                            'Content-type': 'application/json'
-                        }
-                        translate_body = [{'text': welcome_text}]
-
-                        translate_response = requests.post(translate_url, headers=translate_headers, json=translate_body)
-                        translate_result = translate_response.json()
-
-                        translated_text = translate_result[0]['translations'][0]['text']
-                        texts.append({"text": translated_text, "language": target_lang})
-
-                welcome_prompt = {
-                    "id": str(uuid.uuid4()),
-                    "username": username,
-                    "texts": texts,
-                    "tags": []
-                }
-
-                prompt_container.create_item(body=welcome_prompt,)
-
-
-                logging.info(f"Welcome prompt created for user: {username}")
+        # New player registrations have games_played == 0 and total_score == 0
+        new_usernames = [
+            doc.get("username")
+            for doc in documents
+            if doc.get("games_played") == 0 and doc.get("total_score") == 0
+        ]
+
+        # Process the whole change-feed batch together
+        created_count = await welcome.create_welcome_prompts(
+            clients.prompt_container(), clients.translator_client(), clients.translation_cache(), new_usernames)
+
+        logging.info(f"Created {created_count} welcome prompts for {len(new_usernames)} new players")
 
     except Exception as e:
         logging.error(f"Error in utils_welcome: {str(e)}")
+        # Fail the invocation so the retry policy redelivers the batch; welcome prompts
+        # already created are skipped on the next attempt
+        raise
+
+
+@app.function_name(name="utils_tag_index")
+@app.cosmos_db_trigger(arg_name="documents",
+                       database_name=database_name,
+                       container_name=prompt_container_name,
+                       connection="AzureCosmosDBConnectionString",
+                       lease_container_name="leases",
+                       lease_container_prefix="tag-index-ranges-",
+                       create_lease_container_if_not_exists=True,
+                       start_from_beginning=True)
+@app.retry(strategy="exponential_backoff", max_retry_count="5",
+           minimum_interval="00:00:02", maximum_interval="00:01:00")
+@metrics.instrumented
+async def utils_tag_index(documents: func.DocumentList) -> None:
+    try:
+        # Starting from the beginning indexes existing prompts on the first run, and again
+        # whenever the lease prefix changes with the index layout
+        updated_count = await tag_index.add_prompts(
+            clients.tag_index_container(), clients.tag_index_cache(), documents)
+
+        logging.info(f"Indexed {len(documents)} prompts under {updated_count} tags")
+
+    except Exception as e:
+        logging.error(f"Error in utils_tag_index: {str(e)}")
+        # Fail the invocation so the retry policy redelivers the batch
+        raise
 
 
+@app.function_name(name="utils_leaderboard_update")
+@app.cosmos_db_trigger(arg_name="documents",
+                       database_name=database_name,
+                       container_name=player_container_name,
+                       connection="AzureCosmosDBConnectionString",
+                       lease_container_name="leases",
+                       lease_container_prefix="leaderboard-ranges-",
+                       create_lease_container_if_not_exists=True,
+                       start_from_beginning=True)
+@app.retry(strategy="exponential_backoff", max_retry_count="5",
+           minimum_interval="00:00:02", maximum_interval="00:01:00")
+@metrics.instrumented
+async def utils_leaderboard_update(documents: func.DocumentList) -> None:
+    try:
+        # Separate leases from utils_welcome, so both see every player change; a new prefix rebuilds the leaderboard
+        changed_count = await leaderboard.apply_player_changes(clients.leaderboard_container(), documents)
+
+        logging.info(f"Applied {changed_count} of {len(documents)} player changes to the leaderboard")
+
+    except Exception as e:
+        logging.error(f"Error in utils_leaderboard_update: {str(e)}")
+        # Fail the invocation so the retry policy redelivers the batch
+        raise
+
+
+# Pre-build clients when an instance is added (Premium and Dedicated plans only)
+if os.environ.get("EnableWarmUp", "false").lower() == "true":
+    @app.function_name(name="utils_warmup")
+    @app.warm_up_trigger("warmup")
+    async def utils_warmup(warmup) -> None:
+        await clients.warm_up()
+        logging.info("Clients warmed up")
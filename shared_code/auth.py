@@ -0,0 +1,100 @@
+"""Password hashing and stateless session tokens.
+
+Passwords are stored as salted PBKDF2-HMAC-SHA256 hashes, encoded as
+``pbkdf2_sha256$<iterations>$<salt>$<hash>`` so the cost can be raised with
+``PasswordHashIterations`` and existing hashes are upgraded on their next login.
+
+Session tokens are ``<payload>.<signature>``: a base64url JSON payload holding
+the username and expiry, signed with HMAC-SHA256 under ``SessionTokenSecret``.
+Verifying one needs no database read. Tokens are only issued when the secret
+is configured.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+
+PASSWORD_HASH_ALGORITHM = "pbkdf2_sha256"
+PASSWORD_HASH_ITERATIONS = int(os.environ.get("PasswordHashIterations", "600000"))
+SALT_BYTES = 16
+
+SESSION_TOKEN_TTL = int(os.environ.get("SessionTokenTtlSeconds", "3600"))
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def hash_password(password, iterations=None):
+    """Hash ``password`` with a fresh random salt. CPU-bound: run it off the event loop."""
+    iterations = iterations or PASSWORD_HASH_ITERATIONS
+    salt = os.urandom(SALT_BYTES)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+    return f"{PASSWORD_HASH_ALGORITHM}${iterations}${_b64encode(salt)}${_b64encode(digest)}"
+
+
+def verify_password(password, encoded):
+    """Check ``password`` against a hash from ``hash_password`` in constant time."""
+    try:
+        algorithm, iterations, salt, expected = encoded.split("$")
+    except ValueError:
+        return False
+    if algorithm != PASSWORD_HASH_ALGORITHM:
+        return False
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), _b64decode(salt), int(iterations))
+    return hmac.compare_digest(digest, _b64decode(expected))
+
+
+def needs_rehash(encoded):
+    """Whether a stored hash is weaker than the configured cost."""
+    return int(encoded.split("$")[1]) < PASSWORD_HASH_ITERATIONS
+
+
+def _secret():
+    secret = os.environ.get("SessionTokenSecret")
+    return secret.encode("utf-8") if secret else None
+
+
+def tokens_enabled():
+    return _secret() is not None
+
+
+def _sign(payload):
+    return _b64encode(hmac.new(_secret(), payload.encode("ascii"), hashlib.sha256).digest())
+
+
+def issue_token(username, now=None):
+    """Return ``(token, expires_at)`` for ``username``, with ``expires_at`` in epoch seconds."""
+    expires_at = int(now if now is not None else time.time()) + SESSION_TOKEN_TTL
+    payload = _b64encode(json.dumps({"sub": username, "exp": expires_at}, separators=(",", ":")).encode("utf-8"))
+    return f"{payload}.{_sign(payload)}", expires_at
+
+
+def verify_token(token, now=None):
+    """Return the username a valid, unexpired token was issued to, otherwise ``None``."""
+    if not tokens_enabled() or not token or token.count(".") != 1:
+        return None
+    payload, signature = token.split(".")
+    try:
+        if not hmac.compare_digest(signature.encode("utf-8"), _sign(payload).encode("ascii")):
+            return None
+        claims = json.loads(_b64decode(payload))
+    except ValueError:
+        # Not ASCII, not base64 or not JSON
+        return None
+    if claims.get("exp", 0) < (now if now is not None else time.time()):
+        return None
+    return claims.get("sub")
+
+
+def bearer_token(headers):
+    """The token from an ``Authorization: Bearer <token>`` header, or ``None``."""
+    authorization = headers.get("Authorization") or ""
+    scheme, _, token = authorization.partition(" ")
+    return token.strip() if scheme.lower() == "bearer" and token.strip() else None
@@ -0,0 +1,133 @@
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from azure.cosmos import exceptions
+
+
+def normalize_text(text, casefold=True):
+    """Normalize text for use in a cache key: NFKC, optionally case-folded, whitespace collapsed."""
+    text = unicodedata.normalize("NFKC", text)
+    if casefold:
+        text = text.casefold()
+    return " ".join(text.split())
+
+
+def hash_key(*parts):
+    """Build a fixed-length cache key from the given parts."""
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """Thread-safe in-process LRU cache whose entries expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TieredCache:
+    """In-process LRU in front of an optional Cosmos container.
+
+    The container tier is shared by every function instance and survives cold
+    starts. It must be partitioned on ``/id`` and have TTL enabled so that the
+    per-item ``ttl`` written here is honoured.
+    """
+
+    def __init__(self, maxsize, ttl=None, container=None):
+        self.local = LRUCache(maxsize, ttl)
+        self.ttl = ttl
+        self.container = container
+        self.hits = 0
+        self.misses = 0
+        # Background writes to the persisted tier, kept so they are not garbage collected
+        self._pending_writes = set()
+
+    async def get(self, key):
+        found = await self.get_many([key])
+        return found.get(key)
+
+    async def get_many(self, keys):
+        """Look up several keys, reading local misses from Cosmos in one batched point read.
+
+        Returns a dict holding only the keys that were found.
+        """
+        found = {}
+        for key in keys:
+            value = self.local.get(key)
+            if value is not None:
+                found[key] = value
+
+        missing = [key for key in keys if key not in found]
+        if missing and self.container is not None:
+            try:
+                for item in await self.container.read_items(items=[(key, key) for key in missing]):
+                    found[item["id"]] = item["value"]
+                    self.local.set(item["id"], item["value"])
+            except exceptions.CosmosHttpResponseError as e:
+                logging.warning(f"Cache read failed for {len(missing)} keys: {str(e)}")
+
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    async def set(self, key, value):
+        await self.set_many({key: value})
+
+    async def set_many(self, values):
+        """Store values locally and persist them in the background, off the request path."""
+        for key, value in values.items():
+            self.local.set(key, value)
+        if self.container is not None:
+            task = asyncio.create_task(self._persist(values))
+            self._pending_writes.add(task)
+            task.add_done_callback(self._pending_writes.discard)
+
+    async def _persist(self, values):
+        for key, value in values.items():
+            item = {"id": key, "value": value}
+            if self.ttl:
+                item["ttl"] = int(self.ttl)
+            try:
+                await self.container.upsert_item(body=item)
+            except exceptions.CosmosHttpResponseError as e:
+                logging.warning(f"Cache write failed for {key}: {str(e)}")
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.local)}
@@ -0,0 +1,175 @@
+"""Process-wide clients, created lazily on first use and then cached.
+
+Nothing here touches the network or the SDKs at import time, so paths that
+never use Cosmos or the AI services (validation failures, triggers that exit
+early) do not pay for building them, and a missing setting only fails the
+handlers that actually need it.
+"""
+import asyncio
+import logging
+import os
+
+_cosmos_client = None
+_database = None
+_containers = {}
+_service_clients = {}
+_caches = {}
+
+
+def cosmos_client():
+    global _cosmos_client
+    if _cosmos_client is None:
+        from azure.cosmos.aio import CosmosClient
+        from shared_code import metrics
+
+        connection_string = os.environ.get("AzureCosmosDBConnectionString")
+        if not connection_string:
+            raise RuntimeError("AzureCosmosDBConnectionString is not configured")
+        # The hooks see every HTTP attempt, so request charges and retries are recorded per invocation
+        _cosmos_client = CosmosClient.from_connection_string(
+            connection_string,
+            raw_request_hook=metrics.cosmos_request_hook,
+            raw_response_hook=metrics.cosmos_response_hook)
+    return _cosmos_client
+
+
+def database():
+    global _database
+    if _database is None:
+        _database = cosmos_client().get_database_client(os.environ.get("DatabaseName"))
+    return _database
+
+
+def container(setting):
+    """Container client for the container named by the app setting ``setting``."""
+    if setting not in _containers:
+        _containers[setting] = database().get_container_client(os.environ.get(setting))
+    return _containers[setting]
+
+
+def optional_container(setting):
+    """Like ``container``, but ``None`` when the setting is not configured."""
+    return container(setting) if os.environ.get(setting) else None
+
+
+def player_container():
+    return container("PlayerContainerName")
+
+
+def prompt_container():
+    return container("PromptContainerName")
+
+
+def tag_index_container():
+    return container("TagIndexContainerName")
+
+
+def leaderboard_container():
+    return container("LeaderboardContainerName")
+
+
+def translator_client():
+    if "translator" not in _service_clients:
+        from shared_code.http_client import ServiceClient
+
+        _service_clients["translator"] = ServiceClient(
+            os.environ.get("TranslationEndpoint"),
+            name="translator",
+            headers={
+                'Ocp-Apim-Subscription-Key': os.environ.get("TranslationKey"),
+                # Default to italynorth
+                'Ocp-Apim-Subscription-Region': os.environ.get("TranslationRegion", "italynorth")
+            },
+            rate_limit=float(os.environ.get("TranslationRateLimit", "10")))
+    return _service_clients["translator"]
+
+
+def content_safety_client():
+    if "content_safety" not in _service_clients:
+        from shared_code.http_client import ServiceClient
+
+        _service_clients["content_safety"] = ServiceClient(
+            os.environ.get("ContentSafetyEndpoint"),
+            name="content_safety",
+            headers={
+                'Ocp-Apim-Subscription-Key': os.environ.get("ContentSafetyKey")
+            },
+            rate_limit=float(os.environ.get("ContentSafetyRateLimit", "10")))
+    return _service_clients["content_safety"]
+
+
+def moderation_cache():
+    """Content Safety results by normalized text, optionally persisted in Cosmos."""
+    if "moderation" not in _caches:
+        from shared_code.cache import TieredCache
+
+        _caches["moderation"] = TieredCache(
+            maxsize=int(os.environ.get("ModerationCacheSize", "10000")),
+            ttl=int(os.environ.get("ModerationCacheTtlSeconds", "86400")),
+            container=optional_container("ModerationCacheContainerName"))
+    return _caches["moderation"]
+
+
+def translation_cache():
+    """Translations by (normalized text, source, target), optionally persisted in Cosmos."""
+    if "translation" not in _caches:
+        from shared_code.cache import TieredCache
+
+        _caches["translation"] = TieredCache(
+            maxsize=int(os.environ.get("TranslationCacheSize", "10000")),
+            ttl=int(os.environ.get("TranslationCacheTtlSeconds", "2592000")),
+            container=optional_container("TranslationCacheContainerName"))
+    return _caches["translation"]
+
+
+def idempotency_cache():
+    """Stored responses by idempotency key, optionally persisted in Cosmos so every instance can replay them."""
+    if "idempotency" not in _caches:
+        from shared_code.cache import TieredCache
+
+        _caches["idempotency"] = TieredCache(
+            maxsize=int(os.environ.get("IdempotencyCacheSize", "10000")),
+            ttl=int(os.environ.get("IdempotencyKeyTtlSeconds", "86400")),
+            container=optional_container("IdempotencyCacheContainerName"))
+    return _caches["idempotency"]
+
+
+def tag_index_cache():
+    """Tag index documents; short-lived so other instances' updates are picked up."""
+    if "tag_index" not in _caches:
+        from shared_code.cache import LRUCache
+
+        _caches["tag_index"] = LRUCache(
+            maxsize=int(os.environ.get("TagIndexCacheSize", "1000")),
+            ttl=int(os.environ.get("TagIndexCacheTtlSeconds", "30")))
+    return _caches["tag_index"]
+
+
+def leaderboard_cache():
+    """The leaderboard summary and histogram documents, re-read after a few seconds so rankings stay fresh."""
+    if "leaderboard" not in _caches:
+        from shared_code.cache import LRUCache
+
+        _caches["leaderboard"] = LRUCache(
+            maxsize=int(os.environ.get("LeaderboardCacheSize", "1000")),
+            ttl=int(os.environ.get("LeaderboardCacheTtlSeconds", "5")))
+    return _caches["leaderboard"]
+
+
+async def warm_up():
+    """Build every client and open the Cosmos and HTTP connections before the first request."""
+    async def read(get_container):
+        await get_container().read()
+
+    results = await asyncio.gather(
+        read(player_container),
+        read(prompt_container),
+        return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            logging.warning(f"Warm-up failed: {str(result)}")
+
+    translator_client().session
+    content_safety_client().session
+    moderation_cache()
+    translation_cache()
@@ -0,0 +1,191 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from shared_code import metrics
+
+DEFAULT_POOL_SIZE = int(os.environ.get("HttpPoolSize", "20"))
+DEFAULT_CONNECT_TIMEOUT = float(os.environ.get("HttpConnectTimeout", "3.05"))
+DEFAULT_READ_TIMEOUT = float(os.environ.get("HttpReadTimeout", "10"))
+DEFAULT_KEEPALIVE_TIMEOUT = float(os.environ.get("HttpKeepAliveTimeout", "60"))
+DEFAULT_MAX_RETRIES = int(os.environ.get("HttpMaxRetries", "4"))
+DEFAULT_MAX_CONCURRENCY = int(os.environ.get("HttpMaxConcurrency", "16"))
+
+# Exponential backoff bounds in seconds, used when no Retry-After is sent
+BACKOFF_BASE = 0.25
+BACKOFF_CAP = 8.0
+
+# Give up straight away rather than sleep longer than this for one retry
+MAX_RETRY_AFTER = float(os.environ.get("HttpMaxRetryAfter", "10"))
+
+RETRYABLE_STATUS_CODES = (429, 503)
+
+
+class ServiceError(Exception):
+    """An external service answered with an error status."""
+
+    def __init__(self, status_code, message):
+        super().__init__(f"{status_code}: {message}")
+        self.status_code = status_code
+
+
+class ServiceThrottledError(ServiceError):
+    """An external service kept throttling us after every retry."""
+
+    def __init__(self, status_code, message, retry_after=None):
+        super().__init__(status_code, message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Client-side rate limit: ``rate`` requests per second with bursts up to ``capacity``."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class AdaptiveLimiter:
+    """Concurrency limit that halves on throttling and grows back additively (AIMD)."""
+
+    def __init__(self, max_limit, min_limit=1):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(max_limit)
+        self._in_flight = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < int(self.limit))
+            self._in_flight += 1
+
+    async def release(self, throttled=False):
+        async with self._condition:
+            self._in_flight -= 1
+            if throttled:
+                self.limit = max(self.min_limit, self.limit / 2)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+def _retry_after(headers):
+    """Seconds to wait from a Retry-After header, or ``None`` if absent or unparsable."""
+    value = headers.get("Retry-After")
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _backoff(attempt):
+    # Full jitter spreads retries from concurrent callers apart
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * (2 ** attempt)))
+
+
+class ServiceClient:
+    """Pooled keep-alive async HTTP client for a single external endpoint.
+
+    One instance is built per endpoint on first use (see ``shared_code.clients``)
+    and shared by every invocation in the process, so TCP+TLS connections are reused and the
+    authentication headers are only assembled once. The aiohttp session is
+    opened on first use, inside the worker's event loop. Requests pass through
+    a token bucket and an adaptive concurrency limit, and 429/503 responses are
+    retried with jittered backoff that honours Retry-After.
+    """
+
+    def __init__(self, endpoint, headers=None, name="http", pool_size=DEFAULT_POOL_SIZE,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT,
+                 keepalive_timeout=DEFAULT_KEEPALIVE_TIMEOUT, rate_limit=None,
+                 max_retries=DEFAULT_MAX_RETRIES, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        self.endpoint = (endpoint or "").rstrip("/")
+        self.name = name
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.keepalive_timeout = keepalive_timeout
+        self.max_retries = max_retries
+        self.bucket = TokenBucket(rate_limit) if rate_limit else None
+        self.limiter = AdaptiveLimiter(max_concurrency)
+
+        # aiohttp rejects None header values, e.g. for unset keys
+        self.headers = {'Content-type': 'application/json'}
+        self.headers.update({name: value for name, value in (headers or {}).items() if value is not None})
+
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            # Imported here so that loading the app does not pay for aiohttp
+            import aiohttp
+
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=self.keepalive_timeout)
+            timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.connect_timeout, sock_read=self.read_timeout)
+            self._session = aiohttp.ClientSession(headers=self.headers, connector=connector, timeout=timeout)
+        return self._session
+
+    async def _send(self, url, params, body):
+        if self.bucket is not None:
+            await self.bucket.acquire()
+        await self.limiter.acquire()
+        status = None
+        try:
+            async with self.session.post(url, params=params, json=body) as response:
+                status = response.status
+                return status, response.headers, await response.text()
+        finally:
+            await self.limiter.release(throttled=status in RETRYABLE_STATUS_CODES)
+
+    async def post(self, path, params=None, json=None):
+        """POST to ``path`` and return the decoded JSON body of the successful response.
+
+        Raises ``ServiceThrottledError`` if the service is still throttling
+        after ``max_retries`` retries and ``ServiceError`` for other errors.
+        """
+        url = f"{self.endpoint}/{path.lstrip('/')}"
+
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            status, headers, text = await self._send(url, params, json)
+            # Every attempt after the first is a retry
+            metrics.record_http(self.name, time.perf_counter() - started, retry=attempt > 0)
+            if status not in RETRYABLE_STATUS_CODES:
+                break
+
+            retry_after = _retry_after(headers)
+            if attempt == self.max_retries or (retry_after is not None and retry_after > MAX_RETRY_AFTER):
+                raise ServiceThrottledError(status, text, retry_after)
+
+            delay = retry_after if retry_after is not None else _backoff(attempt)
+            logging.warning(f"{url} returned {status}, retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+        if status >= 400:
+            raise ServiceError(status, text)
+        return _decode(text)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+def _decode(text):
+    return json.loads(text) if text else None
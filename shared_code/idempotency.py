@@ -0,0 +1,98 @@
+"""Replay of responses for requests sent with an ``Idempotency-Key`` header.
+
+A client that times out can resend the same request with the same key and get
+the stored response back instead of running the handler (and paying for its
+external calls) a second time. Responses are kept by key and function in the
+cache from ``clients.idempotency_cache`` for ``IdempotencyKeyTtlSeconds``,
+together with a hash of the request body: reusing a key for a different body
+is rejected with 422.
+
+Only 200 responses are stored, so throttling and server errors can be retried.
+A retry that arrives while the first request is still running on the same
+instance waits for it rather than starting again.
+"""
+import asyncio
+import functools
+import json
+import hashlib
+import azure.functions as func
+from shared_code.cache import hash_key
+
+IDEMPOTENCY_KEY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+MAX_KEY_LENGTH = 255
+
+# Requests being handled on this instance, by cache key
+_in_flight = {}
+
+
+def _request_hash(req):
+    return hashlib.sha256(req.get_body() or b"").hexdigest()
+
+
+def _error_response(msg, status_code):
+    return func.HttpResponse(
+        json.dumps({"result": False, "msg": msg}),
+        mimetype="application/json",
+        status_code=status_code)
+
+
+def _replay(stored, request_hash):
+    if stored["request"] != request_hash:
+        return _error_response("Idempotency key was already used for a different request", 422)
+    return func.HttpResponse(
+        stored["body"],
+        mimetype=stored["mimetype"],
+        status_code=stored["status"],
+        headers={REPLAYED_HEADER: "true"})
+
+
+def idempotent(get_cache):
+    """Store and replay the responses of an async HTTP handler by ``Idempotency-Key``.
+
+    ``get_cache`` returns the ``TieredCache`` to use; it is only called for
+    requests that carry a key.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(req, *args, **kwargs):
+            idempotency_key = req.headers.get(IDEMPOTENCY_KEY_HEADER)
+            if not idempotency_key:
+                return await handler(req, *args, **kwargs)
+            if len(idempotency_key) > MAX_KEY_LENGTH:
+                return _error_response(f"{IDEMPOTENCY_KEY_HEADER} longer than {MAX_KEY_LENGTH} characters", 400)
+
+            cache = get_cache()
+            cache_key = hash_key("idempotency", handler.__name__, idempotency_key)
+            request_hash = _request_hash(req)
+
+            stored = await cache.get(cache_key)
+            if stored is not None:
+                return _replay(stored, request_hash)
+            while (in_flight := _in_flight.get(cache_key)) is not None:
+                await asyncio.shield(in_flight)
+                # A finished request stores its response locally before it is done
+                stored = cache.local.get(cache_key)
+                if stored is not None:
+                    return _replay(stored, request_hash)
+
+            done = asyncio.get_running_loop().create_future()
+            _in_flight[cache_key] = done
+            try:
+                response = await handler(req, *args, **kwargs)
+                if response.status_code == 200:
+                    await cache.set(cache_key, {
+                        "request": request_hash,
+                        "status": response.status_code,
+                        "mimetype": response.mimetype,
+                        "body": response.get_body().decode("utf-8")
+                    })
+                return response
+            finally:
+                del _in_flight[cache_key]
+                done.set_result(None)
+
+        return wrapper
+
+    return decorator
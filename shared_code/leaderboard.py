@@ -0,0 +1,292 @@
+"""Leaderboard maintained incrementally from the player change feed.
+
+Everything lives in one logical partition (``board == "global"``) of the
+container named by ``LeaderboardContainerName``, partitioned on ``/board``:
+
+- the ``summary`` document holds the best players sorted by score and the
+  number of players in each score range of ``LeaderboardHistogramRange``
+  points;
+- one ``histogram-<range>`` document per non-empty range holds how many
+  players have each score in it;
+- one ``state-<username>`` document per player records the score last
+  applied to the histogram, so a change can move the player between scores
+  and a redelivered change is a no-op.
+
+Because they share a partition, each change-feed chunk is applied in one
+transactional batch guarded by the summary's etag, which only rewrites the
+histogram ranges the chunk touches. Reads never scan: the top ``k`` come from
+the stored list and a player's rank is one plus the players in higher ranges
+and in higher scores of their own range.
+
+The stored list always holds the exact best ``len(top)`` players. It keeps
+twice ``LeaderboardTopSize`` entries so that players whose score drops out of
+it rarely shrink it below what readers ask for; when they do, ``get_top``
+falls back to an ``ORDER BY`` query on the player container.
+
+A chunk that still conflicts after ``optimistic.MAX_ATTEMPTS`` fails the
+trigger invocation, which is redelivered by its retry policy. Once that is
+exhausted too the chunk's changes are skipped (and logged as an error with
+the players affected) until those players change again, or the leaderboard
+is rebuilt by starting the trigger from a new lease prefix.
+"""
+import asyncio
+import logging
+import os
+from azure.cosmos import exceptions
+from shared_code import optimistic
+
+BOARD = "global"
+SUMMARY_ID = "summary"
+
+MAX_TOP = int(os.environ.get("LeaderboardTopSize", "100"))
+TOP_CAPACITY = MAX_TOP * 2
+
+# Width of the score ranges the histogram is split into
+HISTOGRAM_RANGE = int(os.environ.get("LeaderboardHistogramRange", "100"))
+
+# A transactional batch holds at most 100 operations: the summary, then per player
+# its state and at most two histogram ranges (the old and the new score's)
+PLAYERS_PER_BATCH = 33
+
+TOP_PLAYERS_QUERY = (
+    "SELECT TOP @count c.username, c.total_score, c.games_played FROM c ORDER BY c.total_score DESC"
+)
+
+
+def player_state_id(username):
+    return f"state-{username}"
+
+
+def range_of(score):
+    return score // HISTOGRAM_RANGE
+
+
+def histogram_id(score_range):
+    return f"histogram-{score_range}"
+
+
+def _empty_summary():
+    return {"id": SUMMARY_ID, "board": BOARD, "top": [], "ranges": {}, "players": 0}
+
+
+def _empty_histogram(score_range):
+    return {"id": histogram_id(score_range), "board": BOARD, "range": score_range, "scores": {}}
+
+
+def _sort_top(top):
+    # Ties are listed by username so the order is stable
+    top.sort(key=lambda entry: (-entry["total_score"], entry["username"]))
+
+
+def _count(summary, histogram, score, delta):
+    scores = histogram["scores"]
+    scores[str(score)] = scores.get(str(score), 0) + delta
+    if scores[str(score)] == 0:
+        del scores[str(score)]
+    ranges = summary["ranges"]
+    key = str(histogram["range"])
+    ranges[key] = ranges.get(key, 0) + delta
+    if ranges[key] == 0:
+        del ranges[key]
+
+
+def apply_change(summary, histograms, previous, player):
+    """Move ``player`` from its ``previous`` state (or ``None``) to its new score in place.
+
+    ``histograms`` maps score ranges to their histogram documents and holds the
+    ranges of both the previous and the new score.
+    """
+    score = player["total_score"]
+    if previous is None:
+        summary["players"] += 1
+    else:
+        old_score = previous["total_score"]
+        _count(summary, histograms[range_of(old_score)], old_score, -1)
+    _count(summary, histograms[range_of(score)], score, 1)
+
+    top = [entry for entry in summary["top"] if entry["username"] != player["username"]]
+    was_listed = len(top) < len(summary["top"])
+
+    # Everyone outside the list scores at most its last entry, unless it holds every player
+    holds_everyone = len(top) == summary["players"] - 1
+    if holds_everyone or (top and score >= top[-1]["total_score"]):
+        top.append({"username": player["username"], "total_score": score, "games_played": player["games_played"]})
+        _sort_top(top)
+        del top[TOP_CAPACITY:]
+    elif was_listed:
+        logging.info(f"{player['username']} dropped out of the stored leaderboard")
+    summary["top"] = top
+
+
+def _player_state(player):
+    return {
+        "id": player_state_id(player["username"]),
+        "board": BOARD,
+        "username": player["username"],
+        "total_score": player["total_score"],
+        "games_played": player["games_played"]
+    }
+
+
+async def _apply_chunk(container, players):
+    """Apply one chunk of player changes in a single transactional batch, retrying on conflicts."""
+    async def update():
+        try:
+            summary = await container.read_item(item=SUMMARY_ID, partition_key=BOARD)
+            etag = summary["_etag"]
+        except exceptions.CosmosResourceNotFoundError:
+            summary = _empty_summary()
+            etag = None
+
+        states = await container.read_items(
+            items=[(player_state_id(player["username"]), BOARD) for player in players])
+        previous_by_username = {state["username"]: state for state in states}
+
+        changed = []
+        touched = set()
+        for player in players:
+            previous = previous_by_username.get(player["username"])
+            if previous is not None and previous["total_score"] == player["total_score"] \
+                    and previous["games_played"] == player["games_played"]:
+                continue
+            changed.append(player)
+            touched.add(range_of(player["total_score"]))
+            if previous is not None:
+                touched.add(range_of(previous["total_score"]))
+        if not changed:
+            return 0
+
+        stored = await container.read_items(items=[(histogram_id(score_range), BOARD) for score_range in touched])
+        histograms = {histogram["range"]: histogram for histogram in stored}
+        existing = set(histograms)
+        for score_range in touched:
+            histograms.setdefault(score_range, _empty_histogram(score_range))
+        for player in changed:
+            apply_change(summary, histograms, previous_by_username.get(player["username"]), player)
+
+        if etag is None:
+            operations = [("create", (summary,))]
+        else:
+            operations = [("replace", (SUMMARY_ID, summary), {"if_match_etag": etag})]
+        operations.extend(("upsert", (_player_state(player),)) for player in changed)
+        # The histogram documents are only written under the summary's etag, so they need none of their own
+        for score_range in sorted(touched):
+            if histograms[score_range]["scores"]:
+                operations.append(("upsert", (histograms[score_range],)))
+            elif score_range in existing:
+                operations.append(("delete", (histogram_id(score_range),)))
+
+        try:
+            await container.execute_item_batch(batch_operations=operations, partition_key=BOARD)
+            return len(changed)
+        except exceptions.CosmosBatchOperationError as e:
+            # 412: another invocation updated the summary first; 409: it created it first
+            if e.error_index == 0 and e.status_code in (409, 412):
+                raise optimistic.Conflict()
+            raise
+
+    try:
+        return await optimistic.retry_on_conflict(update, "the leaderboard")
+    except RuntimeError:
+        # Fails the invocation; if its retries run out too these changes wait for the players' next ones
+        usernames = ", ".join(player["username"] for player in players)
+        logging.error(f"Leaderboard changes for {usernames} kept conflicting")
+        raise
+
+
+async def apply_player_changes(container, documents):
+    """Apply player documents from the change feed; returns how many players changed."""
+    # Only the latest version of each player in the batch matters
+    latest = {}
+    for doc in documents:
+        latest[doc["username"]] = {
+            "username": doc["username"],
+            "total_score": doc.get("total_score", 0),
+            "games_played": doc.get("games_played", 0)
+        }
+    players = list(latest.values())
+
+    changed_count = 0
+    # Chunks share the summary document, so they are applied one after another
+    for start in range(0, len(players), PLAYERS_PER_BATCH):
+        changed_count += await _apply_chunk(container, players[start:start + PLAYERS_PER_BATCH])
+    return changed_count
+
+
+async def _read_cached(container, cache, item_id, default):
+    document = cache.get(item_id) if cache is not None else None
+    if document is None:
+        try:
+            document = await container.read_item(item=item_id, partition_key=BOARD)
+        except exceptions.CosmosResourceNotFoundError:
+            document = default
+        if cache is not None:
+            cache.set(item_id, document)
+    return document
+
+
+async def read_summary(container, cache=None):
+    return await _read_cached(container, cache, SUMMARY_ID, _empty_summary())
+
+
+async def read_histogram(container, score_range, cache=None):
+    return await _read_cached(container, cache, histogram_id(score_range), _empty_histogram(score_range))
+
+
+def rank_of(summary, histogram, score):
+    """Competition rank of ``score``: one plus the number of players scoring more.
+
+    ``histogram`` is the document of the range holding ``score``.
+    """
+    score_range = range_of(score)
+    higher_ranges = sum(count for key, count in summary["ranges"].items() if int(key) > score_range)
+    higher_scores = sum(count for key, count in histogram["scores"].items() if int(key) > score)
+    return 1 + higher_ranges + higher_scores
+
+
+async def get_top(summary, player_container, count):
+    """The best ``count`` players with their ranks, from the stored list when it is long enough."""
+    top = summary["top"]
+    if len(top) < min(count, summary["players"]):
+        logging.warning(f"Stored leaderboard holds {len(top)} players, querying the top {count}")
+        top = [player async for player in player_container.query_items(
+            query=TOP_PLAYERS_QUERY,
+            parameters=[{"name": "@count", "value": count}]
+        )]
+        _sort_top(top)
+
+    results = []
+    for position, entry in enumerate(top[:count]):
+        # Tied players share the rank of the first of them
+        if position > 0 and entry["total_score"] == top[position - 1]["total_score"]:
+            rank = results[-1]["rank"]
+        else:
+            rank = position + 1
+        results.append({"rank": rank, **entry})
+    return results
+
+
+async def get_player_rank(container, summary, username, cache=None):
+    """The player's rank and counters as last applied, or ``None`` if not on the leaderboard yet."""
+    try:
+        state = await container.read_item(item=player_state_id(username), partition_key=BOARD)
+    except exceptions.CosmosResourceNotFoundError:
+        return None
+    histogram = await read_histogram(container, range_of(state["total_score"]), cache)
+    return {
+        "rank": rank_of(summary, histogram, state["total_score"]),
+        "username": username,
+        "total_score": state["total_score"],
+        "games_played": state["games_played"]
+    }
+
+
+async def get_leaderboard(container, player_container, cache, count, username=None):
+    """Return ``(top, player)`` where ``player`` is ``None`` unless ``username`` is given and ranked."""
+    summary = await read_summary(container, cache)
+    if not username:
+        return await get_top(summary, player_container, count), None
+    top, player = await asyncio.gather(
+        get_top(summary, player_container, count),
+        get_player_rank(container, summary, username, cache))
+    return top, player
@@ -0,0 +1,178 @@
+"""Per-invocation metrics for Cosmos and external HTTP calls.
+
+``instrumented`` wraps a function handler and opens a ``RequestMetrics`` in a
+context variable, so every call made while handling the invocation - including
+those in tasks started with ``asyncio.gather`` - is added to it without passing
+anything around. Cosmos calls are recorded by hooks installed on the shared
+``CosmosClient`` (see ``shared_code.clients``) and see every HTTP attempt,
+so SDK retries and the partition key ranges a query fans out to are counted.
+``ServiceClient`` records Translator and Content Safety calls.
+
+When the invocation finishes the totals are added to the HTTP response as a
+``Server-Timing`` header and logged as one JSON line starting with
+``Request metrics:``, which can be parsed in Application Insights. Durations of
+a dependency are summed over its calls, so with concurrent calls they can
+exceed the total.
+"""
+import contextvars
+import functools
+import json
+import logging
+import os
+import time
+
+# Log any single Cosmos request that charges at least this many request units
+EXPENSIVE_REQUEST_CHARGE = float(os.environ.get("MetricsExpensiveRequestCharge", "100"))
+
+COSMOS = "cosmos"
+
+_current = contextvars.ContextVar("request_metrics", default=None)
+
+
+class DependencyMetrics:
+    """Totals for one dependency (Cosmos or an external service) within one invocation."""
+
+    def __init__(self):
+        self.calls = 0
+        self.retries = 0
+        self.seconds = 0.0
+
+    def summary(self):
+        return {"calls": self.calls, "retries": self.retries, "duration_ms": round(self.seconds * 1000, 2)}
+
+
+class RequestMetrics:
+    """Everything recorded while handling one invocation of ``function_name``."""
+
+    def __init__(self, function_name):
+        self.function_name = function_name
+        self.started = time.perf_counter()
+        self.seconds = None
+        self.dependencies = {}
+        self.request_charge = 0.0
+        self.queries = 0
+        self.partition_ranges = set()
+
+    def dependency(self, name):
+        if name not in self.dependencies:
+            self.dependencies[name] = DependencyMetrics()
+        return self.dependencies[name]
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self.started
+
+    def summary(self, status_code=None):
+        summary = {
+            "function": self.function_name,
+            "status": status_code,
+            "duration_ms": round((self.seconds or 0) * 1000, 2)
+        }
+        for name, dependency in self.dependencies.items():
+            summary[name] = dependency.summary()
+        if COSMOS in summary:
+            summary[COSMOS].update({
+                "request_charge": round(self.request_charge, 2),
+                "queries": self.queries,
+                "partition_ranges": len(self.partition_ranges)
+            })
+        return summary
+
+    def server_timing(self):
+        entries = [f"total;dur={(self.seconds or 0) * 1000:.1f}"]
+        for name, dependency in self.dependencies.items():
+            description = f"{dependency.calls} calls"
+            if name == COSMOS:
+                description += f", {self.request_charge:.2f} RU"
+                if self.partition_ranges:
+                    description += f", {len(self.partition_ranges)} partition ranges"
+            if dependency.retries:
+                description += f", {dependency.retries} retries"
+            entries.append(f'{name};dur={dependency.seconds * 1000:.1f};desc="{description}"')
+        return ", ".join(entries)
+
+
+def current():
+    """The ``RequestMetrics`` of the running invocation, or ``None`` outside one."""
+    return _current.get()
+
+
+def record_cosmos(operation, status_code, request_charge, seconds, partition_range=None, path=None):
+    """Record one Cosmos HTTP attempt; throttled (429) attempts count as retries."""
+    request_metrics = current()
+    if request_metrics is None:
+        return
+
+    cosmos = request_metrics.dependency(COSMOS)
+    cosmos.calls += 1
+    cosmos.seconds += seconds
+    if status_code == 429:
+        cosmos.retries += 1
+    request_metrics.request_charge += request_charge
+    if operation == "query":
+        request_metrics.queries += 1
+        if partition_range is not None:
+            request_metrics.partition_ranges.add(partition_range)
+
+    if request_charge >= EXPENSIVE_REQUEST_CHARGE:
+        logging.warning(f"Expensive Cosmos {operation} in {request_metrics.function_name}: "
+                        f"{request_charge:.2f} RU on {path}")
+
+
+def record_http(service, seconds, retry=False):
+    """Record one attempt of a call to an external service."""
+    request_metrics = current()
+    if request_metrics is None:
+        return
+
+    dependency = request_metrics.dependency(service)
+    dependency.calls += 1
+    dependency.seconds += seconds
+    if retry:
+        dependency.retries += 1
+
+
+def cosmos_request_hook(pipeline_request):
+    pipeline_request.context["metrics_started"] = time.perf_counter()
+
+
+def cosmos_response_hook(pipeline_response):
+    """``raw_response_hook`` for the Cosmos client, called once per HTTP attempt."""
+    started = pipeline_response.context.get("metrics_started")
+    seconds = time.perf_counter() - started if started is not None else 0.0
+
+    request = pipeline_response.http_request
+    response = pipeline_response.http_response
+    is_query = request.headers.get("x-ms-documentdb-isquery", "").lower() == "true"
+    try:
+        request_charge = float(response.headers.get("x-ms-request-charge", 0))
+    except ValueError:
+        request_charge = 0.0
+
+    record_cosmos(
+        "query" if is_query else request.method.lower(),
+        response.status_code,
+        request_charge,
+        seconds,
+        partition_range=request.headers.get("x-ms-documentdb-partitionkeyrangeid"),
+        path=request.url.split("?")[0])
+
+
+def instrumented(handler):
+    """Collect metrics for every invocation of an async function handler."""
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        request_metrics = RequestMetrics(handler.__name__)
+        token = _current.set(request_metrics)
+        response = None
+        try:
+            response = await handler(*args, **kwargs)
+            return response
+        finally:
+            _current.reset(token)
+            request_metrics.finish()
+            status_code = getattr(response, "status_code", None)
+            if response is not None:
+                response.headers["Server-Timing"] = request_metrics.server_timing()
+            logging.info(f"Request metrics: {json.dumps(request_metrics.summary(status_code))}")
+
+    return wrapper
@@ -0,0 +1,166 @@
+"""One-shot data migrations.
+
+Run from the project root with the same settings as the function app, e.g.
+
+    python -m shared_code.migrations
+"""
+import json
+import logging
+import os
+from azure.cosmos import CosmosClient, PartitionKey, exceptions
+from shared_code.auth import hash_password
+from shared_code.prompts import normalize_tags
+from shared_code.welcome import welcome_prompt_id
+
+SYSTEM_PROPERTIES = ("_rid", "_self", "_etag", "_attachments", "_ts")
+
+LEGACY_PLAYERS_QUERY = "SELECT * FROM c WHERE c.id != c.username"
+
+PLAINTEXT_PASSWORDS_QUERY = "SELECT c.id, c.password FROM c WHERE IS_DEFINED(c.password)"
+
+PROMPTS_WITHOUT_TAGS_LOWER_QUERY = "SELECT c.id, c.username, c.tags FROM c WHERE NOT IS_DEFINED(c.tags_lower)"
+
+LEGACY_WELCOME_PROMPTS_QUERY = (
+    "SELECT * FROM c WHERE NOT STARTSWITH(c.id, 'welcome-') AND ARRAY_LENGTH(c.tags) = 0 "
+    "AND EXISTS(SELECT VALUE t FROM t IN c.texts WHERE CONTAINS(LOWER(t.text), 'welcome to comp3207'))"
+)
+
+PROMPT_INDEXING_POLICY_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cosmos", "prompt_indexing_policy.json")
+
+
+def _partition_key_field(container):
+    return container.read()["partitionKey"]["paths"][0].lstrip("/")
+
+
+def migrate_player_ids(player_container):
+    """Re-key player documents created with a random id so that id == username.
+
+    Each legacy document is copied under its username and then deleted. Running
+    the migration again is safe: already migrated players are not matched.
+    """
+    migrated = 0
+    partition_key_field = _partition_key_field(player_container)
+    legacy_players = player_container.query_items(
+        query=LEGACY_PLAYERS_QUERY,
+        enable_cross_partition_query=True
+    )
+    for player in legacy_players:
+        old_partition_key = player[partition_key_field]
+        new_player = {k: v for k, v in player.items() if k not in SYSTEM_PROPERTIES}
+        new_player["id"] = player["username"]
+
+        try:
+            player_container.create_item(body=new_player)
+        except exceptions.CosmosResourceExistsError:
+            logging.warning(f"Duplicate player document {player['id']} for {player['username']}, leaving it in place")
+            continue
+
+        player_container.delete_item(item=player["id"], partition_key=old_partition_key)
+        migrated += 1
+
+    logging.info(f"Migrated {migrated} player documents")
+    return migrated
+
+
+def migrate_welcome_prompt_ids(prompt_container):
+    """Re-key welcome prompts created with a random id to their deterministic id.
+
+    Must run before ``migrate_player_ids``: re-keying players replays them
+    through the change feed, and the welcome trigger only recognises welcome
+    prompts by their deterministic id.
+    """
+    migrated = 0
+    legacy_welcome_prompts = prompt_container.query_items(
+        query=LEGACY_WELCOME_PROMPTS_QUERY,
+        enable_cross_partition_query=True
+    )
+    for prompt in legacy_welcome_prompts:
+        new_prompt = {k: v for k, v in prompt.items() if k not in SYSTEM_PROPERTIES}
+        new_prompt["id"] = welcome_prompt_id(prompt["username"])
+
+        try:
+            prompt_container.create_item(body=new_prompt)
+        except exceptions.CosmosResourceExistsError:
+            logging.warning(f"Duplicate welcome prompt {prompt['id']} for {prompt['username']}, removing it")
+
+        prompt_container.delete_item(item=prompt["id"], partition_key=prompt["username"])
+        migrated += 1
+
+    logging.info(f"Migrated {migrated} welcome prompts")
+    return migrated
+
+
+def backfill_prompt_tags_lower(prompt_container):
+    """Add the lowercase ``tags_lower`` field to prompts created before it existed."""
+    backfilled = 0
+    legacy_prompts = prompt_container.query_items(
+        query=PROMPTS_WITHOUT_TAGS_LOWER_QUERY,
+        enable_cross_partition_query=True
+    )
+    for prompt in legacy_prompts:
+        prompt_container.patch_item(
+            item=prompt["id"],
+            partition_key=prompt["username"],
+            patch_operations=[{"op": "set", "path": "/tags_lower", "value": normalize_tags(prompt.get("tags", []))}])
+        backfilled += 1
+
+    logging.info(f"Backfilled tags_lower on {backfilled} prompts")
+    return backfilled
+
+
+def hash_plaintext_passwords(player_container):
+    """Replace every remaining plaintext password with a salted hash.
+
+    Logins upgrade players as they come back; this covers those who do not.
+    Must run after ``migrate_player_ids``, as it assumes id == username.
+    """
+    hashed = 0
+    legacy_players = player_container.query_items(
+        query=PLAINTEXT_PASSWORDS_QUERY,
+        enable_cross_partition_query=True
+    )
+    for player in legacy_players:
+        player_container.patch_item(
+            item=player["id"],
+            partition_key=player["id"],
+            patch_operations=[
+                {"op": "set", "path": "/password_hash", "value": hash_password(player["password"])},
+                {"op": "remove", "path": "/password"}
+            ])
+        hashed += 1
+
+    logging.info(f"Hashed {hashed} plaintext passwords")
+    return hashed
+
+
+def apply_prompt_indexing_policy(database, prompt_container):
+    """Replace the prompt container's indexing policy with cosmos/prompt_indexing_policy.json."""
+    with open(PROMPT_INDEXING_POLICY_PATH) as policy_file:
+        indexing_policy = json.load(policy_file)
+
+    properties = prompt_container.read()
+    database.replace_container(
+        prompt_container,
+        partition_key=PartitionKey(path=properties["partitionKey"]["paths"][0]),
+        indexing_policy=indexing_policy)
+    logging.info("Applied prompt indexing policy")
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+
+    cosmos_client = CosmosClient.from_connection_string(os.environ.get("AzureCosmosDBConnectionString"))
+    database = cosmos_client.get_database_client(os.environ.get("DatabaseName"))
+    player_container = database.get_container_client(os.environ.get("PlayerContainerName"))
+    prompt_container = database.get_container_client(os.environ.get("PromptContainerName"))
+
+    migrate_welcome_prompt_ids(prompt_container)
+    migrate_player_ids(player_container)
+    hash_plaintext_passwords(player_container)
+    backfill_prompt_tags_lower(prompt_container)
+    apply_prompt_indexing_policy(database, prompt_container)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import asyncio
+import os
+from shared_code.cache import hash_key, normalize_text
+
+MODERATION_CONCURRENCY = int(os.environ.get("ModerationConcurrency", "8"))
+
+# Bump to invalidate cached results when the moderation policy changes
+MODERATION_POLICY_VERSION = os.environ.get("ModerationPolicyVersion", "1")
+
+# Cosmos caps the size of a query, so very large batches are fetched in chunks
+ID_CHUNK_SIZE = 500
+
+PROMPTS_BY_ID_QUERY = "SELECT c.id, c.texts FROM c WHERE ARRAY_CONTAINS(@ids, c.id)"
+
+# Shared by every invocation so bursts cannot flood Content Safety
+_semaphore = asyncio.Semaphore(MODERATION_CONCURRENCY)
+
+
+async def _query_chunk(container, prompt_ids):
+    return [prompt async for prompt in container.query_items(
+        query=PROMPTS_BY_ID_QUERY,
+        parameters=[{"name": "@ids", "value": prompt_ids}]
+    )]
+
+
+async def fetch_english_texts(container, prompt_ids):
+    """Fetch the English text of every prompt in ``prompt_ids`` with one query per chunk.
+
+    Returns a dict of prompt id to English text. Prompts that do not exist or
+    have no English text are left out.
+    """
+    unique_ids = list(dict.fromkeys(prompt_ids))
+    english_texts = {}
+
+    chunks = await asyncio.gather(*(
+        _query_chunk(container, unique_ids[start:start + ID_CHUNK_SIZE])
+        for start in range(0, len(unique_ids), ID_CHUNK_SIZE)
+    ))
+    for prompts in chunks:
+        for prompt in prompts:
+            if prompt["id"] in english_texts:
+                continue
+            for text_obj in prompt.get("texts", []):
+                if text_obj["language"] == "en":
+                    if text_obj["text"]:
+                        english_texts[prompt["id"]] = text_obj["text"]
+                    break
+
+    return english_texts
+
+
+async def analyze(client, text):
+    """Call Content Safety and return the severity of each category."""
+    moderate_body = {
+        "text": text
+    }
+
+    async with _semaphore:
+        moderate_result = await client.post(
+            "contentsafety/text:analyze",
+            params={"api-version": "2023-10-01"},
+            json=moderate_body)
+
+    # Extract severity scores from the 4 categories
+    categories = moderate_result.get("categoriesAnalysis", [])
+    return {cat["category"]: cat["severity"] for cat in categories}
+
+
+async def cached_analyze(client, text, cache=None):
+    """Analyze ``text``, reusing a cached result for the same normalized text."""
+    if cache is None:
+        return await analyze(client, text)
+
+    key = hash_key("moderation", MODERATION_POLICY_VERSION, normalize_text(text))
+    category_severities = await cache.get(key)
+    if category_severities is None:
+        category_severities = await analyze(client, text)
+        await cache.set(key, category_severities)
+    return category_severities
+
+
+def mean_severity(category_severities):
+    severities = list(category_severities.values())
+    return sum(severities) / len(severities) if severities else 0
+
+
+async def moderate(container, client, prompt_ids, cache=None):
+    """Moderate a batch of prompts, preserving the order of ``prompt_ids``.
+
+    Each distinct English text is looked up in ``cache`` and otherwise sent to
+    Content Safety once, with at most ``MODERATION_CONCURRENCY`` calls in flight.
+    """
+    english_texts = await fetch_english_texts(container, prompt_ids)
+
+    unique_texts = list(dict.fromkeys(english_texts.values()))
+    category_severities = await asyncio.gather(*(cached_analyze(client, text, cache) for text in unique_texts))
+    severities = {text: mean_severity(categories) for text, categories in zip(unique_texts, category_severities)}
+
+    results = []
+    for prompt_id in prompt_ids:
+        if prompt_id not in english_texts:
+            continue
+
+        average_severity = severities[english_texts[prompt_id]]
+
+        outcome = average_severity > 2
+
+        # Round to 2 decimal places for consistency
+        average_severity = round(average_severity, 2)
+
+        results.append({
+            "prompt-id": prompt_id,
+            "outcome": outcome,
+            "average_severity": average_severity
+        })
+
+    return results
@@ -0,0 +1,31 @@
+"""Retry loop for read-modify-write updates guarded by an etag.
+
+An update reads what it needs, computes the new state and writes it
+conditionally. If another writer got there first it raises ``Conflict`` and
+is run again after a random delay that doubles per attempt, so writers that
+collided do not collide again in lockstep.
+"""
+import asyncio
+import random
+
+# Attempts at an update before giving up on a contended document
+MAX_ATTEMPTS = 8
+
+# Conflicting writers back off for a random delay up to this many seconds, doubling per attempt
+BACKOFF_BASE = 0.02
+
+
+class Conflict(Exception):
+    """Raised by an update that lost the race to another writer."""
+
+
+async def retry_on_conflict(update, description):
+    """Run ``update()`` until it finishes without raising ``Conflict`` and return its result."""
+    for attempt in range(MAX_ATTEMPTS):
+        if attempt > 0:
+            await asyncio.sleep(random.uniform(0, BACKOFF_BASE * 2 ** attempt))
+        try:
+            return await update()
+        except Conflict:
+            continue
+    raise RuntimeError(f"Gave up updating {description} after {MAX_ATTEMPTS} conflicting attempts")
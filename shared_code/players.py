@@ -0,0 +1,99 @@
+import asyncio
+import hmac
+import logging
+from azure.cosmos import exceptions
+from shared_code import auth
+
+# Players are stored with id == username, so every lookup is a point read
+# (or a single-partition query) instead of a cross-partition scan.
+PLAYER_EXISTS_QUERY = "SELECT VALUE 1 FROM c WHERE c.id = @username"
+
+
+async def get_player(container, username):
+    """Point-read a player by username, returning ``None`` if it does not exist."""
+    try:
+        return await container.read_item(item=username, partition_key=username)
+    except exceptions.CosmosResourceNotFoundError:
+        return None
+
+
+async def player_exists(container, username):
+    """Check that a player exists without transferring the document body."""
+    results = [result async for result in container.query_items(
+        query=PLAYER_EXISTS_QUERY,
+        parameters=[{"name": "@username", "value": username}],
+        partition_key=username
+    )]
+    return len(results) > 0
+
+
+async def create_player(container, username, password):
+    """Insert a new player document keyed by username, storing only a salted password hash.
+
+    Raises ``CosmosResourceExistsError`` if the username is already taken, which
+    makes the uniqueness check and the insert a single atomic round trip.
+    """
+    # Hashing is deliberately slow, so keep it off the event loop
+    password_hash = await asyncio.to_thread(auth.hash_password, password)
+    new_player = {
+        "id": username,
+        "username": username,
+        "password_hash": password_hash,
+        "games_played": 0,
+        "total_score": 0
+    }
+    return await container.create_item(body=new_player)
+
+
+async def increment_stats(container, username, add_to_games_played, add_to_score):
+    """Atomically add to a player's counters with a server-side patch.
+
+    A single ``incr`` patch avoids the read-modify-write round trip and cannot
+    lose concurrent updates. Raises ``CosmosResourceNotFoundError`` if the
+    player does not exist.
+    """
+    patch_operations = [
+        {"op": "incr", "path": "/games_played", "value": add_to_games_played},
+        {"op": "incr", "path": "/total_score", "value": add_to_score}
+    ]
+    return await container.patch_item(item=username, partition_key=username, patch_operations=patch_operations)
+
+
+async def _upgrade_password(container, player, password):
+    """Replace a plaintext password or an outdated hash with a hash at the current cost."""
+    password_hash = await asyncio.to_thread(auth.hash_password, password)
+    patch_operations = [{"op": "set", "path": "/password_hash", "value": password_hash}]
+    if "password" in player:
+        patch_operations.append({"op": "remove", "path": "/password"})
+    try:
+        await container.patch_item(
+            item=player["id"], partition_key=player["id"], patch_operations=patch_operations)
+    except exceptions.CosmosHttpResponseError as e:
+        # The login itself succeeded; the upgrade is retried on the next one
+        logging.warning(f"Could not upgrade the password hash of {player['id']}: {str(e)}")
+
+
+async def authenticate(container, username, password):
+    """Check a player's password with one point read.
+
+    Players registered before passwords were hashed, or hashed at a lower cost
+    than ``PasswordHashIterations``, are upgraded after a successful check.
+    """
+    player = await get_player(container, username)
+    if player is None:
+        # Spend the same time as a real check so unknown usernames cannot be told apart
+        await asyncio.to_thread(auth.hash_password, password)
+        return False
+
+    if "password_hash" in player:
+        if not await asyncio.to_thread(auth.verify_password, password, player["password_hash"]):
+            return False
+        if auth.needs_rehash(player["password_hash"]):
+            await _upgrade_password(container, player, password)
+        return True
+
+    # Legacy plaintext password
+    if not hmac.compare_digest(player.get("password", "").encode("utf-8"), password.encode("utf-8")):
+        return False
+    await _upgrade_password(container, player, password)
+    return True
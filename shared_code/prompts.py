@@ -0,0 +1,270 @@
+import asyncio
+import base64
+import logging
+import os
+import uuid
+from collections import defaultdict
+from azure.cosmos import exceptions
+from shared_code.cache import normalize_text
+
+# Prompts store a lowercase copy of their tags so tag filters run server-side
+# against the index on /tags_lower/[] (see cosmos/prompt_indexing_policy.json).
+PROMPTS_BY_PLAYERS_AND_TAGS_QUERY = (
+    "SELECT c.id, c.username, {texts} AS texts, c.tags FROM c "
+    "WHERE ARRAY_CONTAINS(@players, c.username) "
+    "AND EXISTS(SELECT VALUE t FROM t IN c.tags_lower WHERE ARRAY_CONTAINS(@tags, t))"
+)
+
+ALL_TEXTS = "c.texts"
+LANGUAGE_TEXTS = "ARRAY(SELECT VALUE t FROM t IN c.texts WHERE ARRAY_CONTAINS(@languages, t.language))"
+
+MAX_PAGE_SIZE = 1000
+
+PROMPT_KEYS_BY_USERNAME_QUERY = "SELECT c.id, c.username FROM c WHERE c.username = @username"
+
+# Cosmos transactional batches hold at most 100 operations
+BATCH_SIZE = 100
+DELETE_PAGE_SIZE = int(os.environ.get("DeletePageSize", "1000"))
+DELETE_CONCURRENCY = int(os.environ.get("DeleteConcurrency", "4"))
+
+MAX_BULK_CREATE = int(os.environ.get("BulkCreateMaxPrompts", "1000"))
+CREATE_CONCURRENCY = int(os.environ.get("BulkCreateConcurrency", "4"))
+
+# Prompt ids are derived from the author and the normalized text, so the same
+# prompt submitted twice maps to the same document and the second insert fails
+PROMPT_ID_NAMESPACE = uuid.UUID("6f1c2f8e-3b7a-4d52-9a4e-2c0d8b1e5f37")
+
+# Shared by every invocation so large deletes and imports cannot starve the account
+_delete_semaphore = asyncio.Semaphore(DELETE_CONCURRENCY)
+_create_semaphore = asyncio.Semaphore(CREATE_CONCURRENCY)
+
+
+def normalize_tags(tags):
+    """Lowercase and de-duplicate tags, preserving their order."""
+    return list(dict.fromkeys(tag.lower() for tag in tags))
+
+
+def prompt_id(username, text):
+    """Deterministic id of ``username``'s prompt with ``text``, ignoring case and whitespace."""
+    return str(uuid.uuid5(PROMPT_ID_NAMESPACE, f"{username}\x1f{normalize_text(text)}"))
+
+
+def new_prompt(username, texts, tags):
+    """Build a prompt document keyed by its original text, with a lowercase copy of its tags."""
+    unique_tags = list(dict.fromkeys(tags))
+    return {
+        "id": prompt_id(username, texts[0]["text"]),
+        "username": username,
+        "texts": texts,
+        "tags": unique_tags,
+        "tags_lower": normalize_tags(unique_tags)
+    }
+
+
+async def prompt_exists(container, prompt_id, username):
+    """Point-read a prompt by its key; cheaper than a query for a single document."""
+    try:
+        await container.read_item(item=prompt_id, partition_key=username)
+        return True
+    except exceptions.CosmosResourceNotFoundError:
+        return False
+
+
+async def existing_ids(container, keys):
+    """Return the ids among ``keys`` (``(id, username)`` pairs) that are already stored, in one batched read."""
+    if not keys:
+        return set()
+    docs = await container.read_items(items=list(keys))
+    return {doc["id"] for doc in docs}
+
+
+def _players_and_tags_query(container, players, tags, languages=None, **kwargs):
+    parameters = [
+        {"name": "@players", "value": list(players)},
+        {"name": "@tags", "value": normalize_tags(tags)}
+    ]
+    if languages:
+        parameters.append({"name": "@languages", "value": list(languages)})
+
+    # Project out translations the caller did not ask for on the server
+    query = PROMPTS_BY_PLAYERS_AND_TAGS_QUERY.format(texts=LANGUAGE_TEXTS if languages else ALL_TEXTS)
+    return container.query_items(
+        query=query,
+        parameters=parameters,
+        **kwargs
+    )
+
+
+async def first_page(pager):
+    """Return the items of the next page of an async ``by_page()`` iterator, or ``[]``."""
+    try:
+        page = await pager.__anext__()
+    except StopAsyncIteration:
+        return []
+    return [item async for item in page]
+
+
+async def find_by_players_and_tags(container, players, tags, languages=None):
+    """Return every prompt by one of ``players`` that has at least one of ``tags``.
+
+    Results are grouped in the order the players were given. If ``languages``
+    is given only those translations are returned.
+    """
+    player_order = {player: index for index, player in reversed(list(enumerate(players)))}
+    prompts = [prompt async for prompt in _players_and_tags_query(container, players, tags, languages)]
+    return sorted(prompts, key=lambda prompt: player_order[prompt["username"]])
+
+
+def encode_continuation(token):
+    if token is None:
+        return None
+    return base64.urlsafe_b64encode(token.encode("utf-8")).decode("ascii")
+
+
+def decode_continuation(token):
+    if not token:
+        return None
+    return base64.urlsafe_b64decode(token.encode("ascii")).decode("utf-8")
+
+
+async def find_page_by_players_and_tags(container, players, tags, page_size, continuation=None, languages=None):
+    """Return one page of matching prompts and an opaque token for the next page.
+
+    The token wraps the Cosmos continuation token and is ``None`` on the last
+    page. Pages are returned in the order Cosmos produces them.
+    """
+    page_size = max(1, min(int(page_size), MAX_PAGE_SIZE))
+    pager = _players_and_tags_query(
+        container, players, tags, languages, max_item_count=page_size
+    ).by_page(continuation_token=decode_continuation(continuation))
+
+    prompts = await first_page(pager)
+    return prompts, encode_continuation(pager.continuation_token)
+
+
+async def _delete_one(container, partition_key, prompt_id):
+    try:
+        await container.delete_item(item=prompt_id, partition_key=partition_key)
+        return 1
+    except exceptions.CosmosResourceNotFoundError:
+        return 0
+
+
+async def _delete_batch(container, partition_key, prompt_ids):
+    """Delete ``prompt_ids`` from one logical partition and return how many were removed.
+
+    A transactional batch fails as a whole if any item is already gone, so on
+    failure the ids are deleted one at a time and missing items are skipped.
+    """
+    async with _delete_semaphore:
+        try:
+            await container.execute_item_batch(
+                batch_operations=[("delete", (prompt_id,)) for prompt_id in prompt_ids],
+                partition_key=partition_key)
+            return len(prompt_ids)
+        except exceptions.CosmosBatchOperationError:
+            deleted = await asyncio.gather(*(
+                _delete_one(container, partition_key, prompt_id) for prompt_id in prompt_ids
+            ))
+            return sum(deleted)
+
+
+async def delete_by_username(container, username):
+    """Delete every prompt by ``username`` page by page.
+
+    Each page holds only ids, grouped per partition key into transactional
+    batches that run concurrently. Every page re-queries what is left, so a run
+    that fails part-way can simply be repeated to resume.
+
+    Returns ``(deleted_count, failed_count)``.
+    """
+    deleted_count = 0
+    failed_count = 0
+
+    while True:
+        page = await first_page(container.query_items(
+            query=PROMPT_KEYS_BY_USERNAME_QUERY,
+            parameters=[{"name": "@username", "value": username}],
+            partition_key=username,
+            max_item_count=DELETE_PAGE_SIZE
+        ).by_page())
+        if len(page) == 0:
+            break
+
+        ids_by_partition = defaultdict(list)
+        for prompt in page:
+            ids_by_partition[prompt["username"]].append(prompt["id"])
+
+        batches = [
+            (partition_key, prompt_ids[start:start + BATCH_SIZE])
+            for partition_key, prompt_ids in ids_by_partition.items()
+            for start in range(0, len(prompt_ids), BATCH_SIZE)
+        ]
+        outcomes = await asyncio.gather(*(
+            _delete_batch(container, partition_key, prompt_ids)
+            for partition_key, prompt_ids in batches
+        ), return_exceptions=True)
+
+        page_deleted_count = 0
+        for outcome, (partition_key, prompt_ids) in zip(outcomes, batches):
+            if isinstance(outcome, Exception):
+                logging.error(f"Error deleting prompts for {partition_key}: {str(outcome)}")
+                failed_count += len(prompt_ids)
+            else:
+                page_deleted_count += outcome
+
+        deleted_count += page_deleted_count
+        logging.info(f"Deleted {deleted_count} prompts for {username} so far")
+
+        # Stop rather than loop forever if this page could not be fully deleted
+        if failed_count > 0 or page_deleted_count == 0:
+            break
+
+    return deleted_count, failed_count
+
+
+async def _create_batch(container, partition_key, prompts):
+    """Create ``prompts`` in one logical partition, returning ``None`` or the error for each.
+
+    The batch is transactional, so if any create fails they are retried one at
+    a time to find out which ones did.
+    """
+    async with _create_semaphore:
+        try:
+            await container.execute_item_batch(
+                batch_operations=[("create", (prompt,)) for prompt in prompts],
+                partition_key=partition_key)
+            return [None] * len(prompts)
+        except exceptions.CosmosBatchOperationError:
+            outcomes = await asyncio.gather(*(
+                container.create_item(body=prompt) for prompt in prompts
+            ), return_exceptions=True)
+            return [outcome if isinstance(outcome, Exception) else None for outcome in outcomes]
+
+
+async def create_many(container, prompts):
+    """Insert many prompts with one transactional batch per partition and 100 prompts.
+
+    Batches run concurrently. Returns one entry per prompt, in order: ``None``
+    if it was created, otherwise the exception that stopped it.
+    """
+    indexes_by_partition = defaultdict(list)
+    for index, prompt in enumerate(prompts):
+        indexes_by_partition[prompt["username"]].append(index)
+
+    batches = [
+        (partition_key, indexes[start:start + BATCH_SIZE])
+        for partition_key, indexes in indexes_by_partition.items()
+        for start in range(0, len(indexes), BATCH_SIZE)
+    ]
+    outcomes = await asyncio.gather(*(
+        _create_batch(container, partition_key, [prompts[index] for index in indexes])
+        for partition_key, indexes in batches
+    ), return_exceptions=True)
+
+    errors = [None] * len(prompts)
+    for outcome, (partition_key, indexes) in zip(outcomes, batches):
+        for position, index in enumerate(indexes):
+            # A batch that could not be sent at all fails every prompt in it
+            errors[index] = outcome if isinstance(outcome, Exception) else outcome[position]
+    return errors
@@ -0,0 +1,365 @@
+"""Tag -> prompt index for sampling prompts without scanning the prompt container.
+
+The container named by ``TagIndexContainerName`` is partitioned on ``/tag``
+(the lowercase tag). Each tag's logical partition holds:
+
+- bucket documents, each listing the ``[id, username]`` keys of the prompts
+  whose id hashes into its range, and holding at most ``TagIndexBucketSize``
+  keys;
+- a ``directory`` document recording every bucket's hash range and size.
+
+A bucket that would grow past the cap is split in half by hash range, so a
+tag gains buckets as it grows and no document's size depends on the size of
+the tag. The directory grows by one small entry per bucket. Writes read and
+replace only the buckets their prompts hash into, and sampling reads the
+directory, draws buckets by size and reads only the buckets it drew.
+
+The ``utils_tag_index`` change-feed trigger applies each batch of prompts
+to a tag in one transactional batch per chunk of buckets, guarded by the
+etags of the directory and the buckets, so bucket contents, splits and
+sizes never disagree. Writers to the same tag therefore take turns on the
+directory's etag. The change feed does not report deletes, so sampling
+drops keys whose prompt is gone and removes them from the index in the
+background.
+
+Index documents are cached per instance for ``TagIndexCacheTtlSeconds``; an
+instance replaces its cached copy whenever it updates a document itself.
+"""
+import asyncio
+import bisect
+import copy
+import logging
+import os
+import random
+import zlib
+from collections import defaultdict
+from azure.cosmos import exceptions
+from shared_code import optimistic
+from shared_code.prompts import normalize_tags
+
+MAX_SAMPLE_SIZE = 100
+
+BUCKET_CAPACITY = int(os.environ.get("TagIndexBucketSize", "1000"))
+
+DIRECTORY_ID = "directory"
+
+# Prompt ids hash into [0, HASH_SPACE)
+HASH_SPACE = 2 ** 32
+
+# A transactional batch holds at most 100 operations, one is the directory
+MAX_BATCH_OPERATIONS = 99
+
+# Rounds of bucket reads before settling for fewer prompts than asked for
+MAX_SAMPLE_ROUNDS = 4
+
+# Background index repairs, kept so they are not garbage collected
+_pending_updates = set()
+
+
+class TagEntries:
+    """The prompt keys of one bucket, as a list to sample from and a set of ids to test membership."""
+
+    def __init__(self, keys):
+        self.keys = [tuple(key) for key in keys]
+        self.ids = {prompt_id for prompt_id, _ in self.keys}
+
+    def __len__(self):
+        return len(self.keys)
+
+
+class Directory:
+    """The buckets of one tag: their hash ranges and sizes."""
+
+    def __init__(self, doc=None):
+        buckets = sorted(
+            (info["lo"], bucket_id, info["count"]) for bucket_id, info in (doc or {}).get("buckets", {}).items())
+        self._los = [lo for lo, _, _ in buckets]
+        self._bucket_ids = [bucket_id for _, bucket_id, _ in buckets]
+        self.counts = {bucket_id: count for _, bucket_id, count in buckets}
+
+    def bucket_for(self, prompt_id):
+        """The id of the bucket ``prompt_id`` hashes into, or ``None`` if the tag has no buckets."""
+        position = bisect.bisect_right(self._los, key_hash(prompt_id)) - 1
+        return self._bucket_ids[position] if position >= 0 else None
+
+
+def key_hash(prompt_id):
+    return zlib.crc32(prompt_id.encode("utf-8"))
+
+
+def bucket_doc_id(bucket_id):
+    return f"bucket-{bucket_id}"
+
+
+def _new_directory(tag):
+    return {"id": DIRECTORY_ID, "tag": tag, "next": 1, "buckets": {"0": {"lo": 0, "hi": HASH_SPACE, "count": 0}}}
+
+
+def _split(lo, hi, keys):
+    """Halve ``[lo, hi)`` until every piece holds at most ``BUCKET_CAPACITY`` keys; returns ``(lo, hi, keys)``."""
+    if len(keys) <= BUCKET_CAPACITY or hi - lo < 2:
+        return [(lo, hi, keys)]
+    middle = (lo + hi) // 2
+    lower = [key for key in keys if key_hash(key[0]) < middle]
+    upper = [key for key in keys if key_hash(key[0]) >= middle]
+    return _split(lo, middle, lower) + _split(middle, hi, upper)
+
+
+async def _read_cached(container, cache, keys, parse, missing_value):
+    """Return ``{(tag, id): parse(doc)}`` for ``keys``, reading cache misses in one batched point read."""
+    values = {}
+    for key in keys:
+        value = cache.get(key)
+        if value is not None:
+            values[key] = value
+
+    missing = [key for key in keys if key not in values]
+    if missing:
+        for doc in await container.read_items(items=[(doc_id, tag) for tag, doc_id in missing]):
+            values[(doc["tag"], doc["id"])] = parse(doc)
+        # Remember documents that do not exist too, so they are not read again until expiry
+        for key in missing:
+            values.setdefault(key, missing_value)
+            cache.set(key, values[key])
+    return values
+
+
+async def read_directories(container, cache, tags):
+    """Return ``{tag: Directory}`` for ``tags``."""
+    directories = await _read_cached(container, cache, [(tag, DIRECTORY_ID) for tag in tags], Directory, Directory())
+    return {tag: directory for (tag, _), directory in directories.items()}
+
+
+async def read_buckets(container, cache, tag_buckets):
+    """Return ``{(tag, bucket_id): TagEntries}`` for ``(tag, bucket_id)`` pairs."""
+    entries = await _read_cached(
+        container, cache, [(tag, bucket_doc_id(bucket_id)) for tag, bucket_id in tag_buckets],
+        lambda doc: TagEntries(doc["prompts"]), TagEntries([]))
+    return {(tag, doc_id[len("bucket-"):]): bucket_entries for (tag, doc_id), bucket_entries in entries.items()}
+
+
+async def _update_some_buckets(container, cache, tag, added, removed):
+    """Apply as many bucket changes as fit in one transactional batch; returns the ids applied."""
+    try:
+        directory_doc = await container.read_item(item=DIRECTORY_ID, partition_key=tag)
+    except exceptions.CosmosResourceNotFoundError:
+        if not added:
+            return set(removed)
+        directory_doc = None
+    new_directory = copy.deepcopy(directory_doc) if directory_doc is not None else _new_directory(tag)
+    directory = Directory(new_directory)
+
+    added_by_bucket = defaultdict(list)
+    for prompt_id, username in added.items():
+        added_by_bucket[directory.bucket_for(prompt_id)].append([prompt_id, username])
+    removed_by_bucket = defaultdict(set)
+    for prompt_id in removed:
+        removed_by_bucket[directory.bucket_for(prompt_id)].add(prompt_id)
+    bucket_ids = list(dict.fromkeys([*added_by_bucket, *removed_by_bucket]))
+
+    docs = await container.read_items(items=[(bucket_doc_id(bucket_id), tag) for bucket_id in bucket_ids])
+    docs_by_id = {doc["id"]: doc for doc in docs}
+
+    operations = []
+    applied = set()
+    written = {}
+    for bucket_id in bucket_ids:
+        doc = docs_by_id.get(bucket_doc_id(bucket_id))
+        keys = [key for key in (doc["prompts"] if doc else []) if key[0] not in removed_by_bucket[bucket_id]]
+        known_ids = {key[0] for key in keys}
+        for key in added_by_bucket[bucket_id]:
+            if key[0] not in known_ids:
+                keys.append(key)
+                known_ids.add(key[0])
+
+        bucket_ids_done = {key[0] for key in added_by_bucket[bucket_id]} | removed_by_bucket[bucket_id]
+        if doc is not None and keys == doc["prompts"]:
+            applied |= bucket_ids_done
+            continue
+
+        info = new_directory["buckets"][bucket_id]
+        pieces = _split(info["lo"], info["hi"], keys)
+        if operations and len(operations) + len(pieces) > MAX_BATCH_OPERATIONS:
+            break
+
+        for position, (lo, hi, piece_keys) in enumerate(pieces):
+            piece_id = bucket_id
+            if position > 0:
+                piece_id = str(new_directory["next"])
+                new_directory["next"] += 1
+            new_directory["buckets"][piece_id] = {"lo": lo, "hi": hi, "count": len(piece_keys)}
+            body = {"id": bucket_doc_id(piece_id), "tag": tag, "lo": lo, "hi": hi, "prompts": piece_keys}
+            if piece_id == bucket_id and doc is not None:
+                operations.append(("replace", (body["id"], body), {"if_match_etag": doc["_etag"]}))
+            else:
+                operations.append(("create", (body,)))
+            written[piece_id] = piece_keys
+        applied |= bucket_ids_done
+
+    if operations:
+        if directory_doc is None:
+            operations.append(("create", (new_directory,)))
+        else:
+            operations.append(
+                ("replace", (DIRECTORY_ID, new_directory), {"if_match_etag": directory_doc["_etag"]}))
+        try:
+            await container.execute_item_batch(batch_operations=operations, partition_key=tag)
+        except exceptions.CosmosBatchOperationError as e:
+            # 412: another writer changed a bucket or the directory first; 409: it created them first
+            if e.status_code in (409, 412):
+                raise optimistic.Conflict()
+            raise
+
+    cache.set((tag, DIRECTORY_ID), Directory(new_directory))
+    for piece_id, piece_keys in written.items():
+        cache.set((tag, bucket_doc_id(piece_id)), TagEntries(piece_keys))
+    return applied
+
+
+async def _update_tag(container, cache, tag, added=(), removed=()):
+    """Add ``added`` keys to and drop ``removed`` ids from one tag."""
+    added = {prompt_id: username for prompt_id, username in added}
+    removed = set(removed)
+    while added or removed:
+        applied = await optimistic.retry_on_conflict(
+            lambda: _update_some_buckets(container, cache, tag, added, removed), f"tag {tag}")
+        added = {prompt_id: username for prompt_id, username in added.items() if prompt_id not in applied}
+        removed -= applied
+
+
+async def add_prompts(container, cache, prompts):
+    """Index ``prompts`` (documents from the change feed) under each of their tags.
+
+    Returns the number of tags updated.
+    """
+    added_by_tag = defaultdict(list)
+    for prompt in prompts:
+        tags = prompt.get("tags_lower") or normalize_tags(prompt.get("tags") or [])
+        for tag in tags:
+            added_by_tag[tag].append((prompt["id"], prompt["username"]))
+
+    await asyncio.gather(*(
+        _update_tag(container, cache, tag, added=keys) for tag, keys in added_by_tag.items()
+    ))
+    return len(added_by_tag)
+
+
+async def _remove_stale(container, cache, stale_by_tag):
+    try:
+        await asyncio.gather(*(
+            _update_tag(container, cache, tag, removed=prompt_ids) for tag, prompt_ids in stale_by_tag.items()
+        ))
+    except Exception as e:
+        logging.warning(f"Could not remove deleted prompts from the tag index: {str(e)}")
+
+
+async def sample_keys(container, cache, directories, count, rng=random):
+    """Pick up to ``count`` distinct prompt keys uniformly from the union of the tags.
+
+    Returns the keys and the ``{(tag, bucket_id): TagEntries}`` that were read.
+    Buckets are drawn with probability proportional to their size, then a key
+    uniformly within the bucket. A prompt under ``n`` of the tags is drawn
+    ``n`` times as often, so it is only kept with probability ``1 / n``; its
+    copies are counted by reading the bucket it hashes into under each other
+    tag. Small unions are read in full and sampled directly.
+    """
+    weighted = [
+        (tag, bucket_id, size)
+        for tag, directory in directories.items()
+        for bucket_id, size in directory.counts.items() if size > 0
+    ]
+    if not weighted:
+        return [], {}
+
+    total = sum(size for _, _, size in weighted)
+    # The union holds at least total / tags prompts, so here it is over twice ``count``
+    if count * len(directories) * 2 >= total:
+        entries = await read_buckets(container, cache, [(tag, bucket_id) for tag, bucket_id, _ in weighted])
+        union = {}
+        for bucket_entries in entries.values():
+            for prompt_id, username in bucket_entries.keys:
+                union.setdefault(prompt_id, username)
+        return rng.sample(list(union.items()), min(count, len(union))), entries
+
+    weights = [size for _, _, size in weighted]
+    entries = {}
+    chosen = {}
+    for _ in range(MAX_SAMPLE_ROUNDS):
+        if len(chosen) >= count:
+            break
+        # Draw extra buckets so that rejections rarely need another round of reads
+        draws = rng.choices(weighted, weights, k=(count - len(chosen)) * 2)
+        entries.update(await read_buckets(
+            container, cache, list({(tag, bucket_id) for tag, bucket_id, _ in draws} - entries.keys())))
+
+        candidates = []
+        for tag, bucket_id, _ in draws:
+            bucket_entries = entries[(tag, bucket_id)]
+            if len(bucket_entries) > 0:
+                candidates.append(rng.choice(bucket_entries.keys))
+
+        homes = {
+            prompt_id: [(tag, directory.bucket_for(prompt_id)) for tag, directory in directories.items()
+                        if directory.bucket_for(prompt_id) is not None]
+            for prompt_id, _ in candidates
+        }
+        if len(directories) > 1:
+            entries.update(await read_buckets(
+                container, cache, list({home for keys in homes.values() for home in keys} - entries.keys())))
+
+        for prompt_id, username in candidates:
+            if len(chosen) >= count:
+                break
+            if prompt_id in chosen:
+                continue
+            # A bucket cached from before a split may hold keys whose home was not read; count it once
+            copies = sum(1 for home in homes[prompt_id] if home in entries and prompt_id in entries[home].ids)
+            if copies > 1 and rng.random() * copies >= 1:
+                continue
+            chosen[prompt_id] = username
+    return list(chosen.items()), entries
+
+
+async def sample(prompt_container, index_container, cache, tags, count, language):
+    """Return up to ``count`` random prompts carrying any of ``tags``, with their text in ``language``.
+
+    Reads the directory of every uncached tag, the buckets the sample falls
+    in and the sampled prompts in a few batched point reads, none of which
+    grows with the number of prompts under the tags.
+    """
+    tags = normalize_tags(tags)
+    directories = await read_directories(index_container, cache, tags)
+    keys, entries = await sample_keys(index_container, cache, directories, count)
+    if not keys:
+        return []
+
+    docs = await prompt_container.read_items(items=keys)
+    docs_by_id = {doc["id"]: doc for doc in docs}
+
+    # Prompts deleted since they were indexed
+    stale_by_tag = defaultdict(list)
+    for prompt_id, _ in keys:
+        if prompt_id not in docs_by_id:
+            for (tag, _), bucket_entries in entries.items():
+                if prompt_id in bucket_entries.ids:
+                    stale_by_tag[tag].append(prompt_id)
+    if stale_by_tag:
+        task = asyncio.create_task(_remove_stale(index_container, cache, stale_by_tag))
+        _pending_updates.add(task)
+        task.add_done_callback(_pending_updates.discard)
+
+    results = []
+    for prompt_id, _ in keys:
+        doc = docs_by_id.get(prompt_id)
+        if doc is None:
+            continue
+        text = next((t["text"] for t in doc.get("texts", []) if t["language"] == language), None)
+        if text is None:
+            continue
+        results.append({
+            "id": doc["id"],
+            "username": doc["username"],
+            "text": text,
+            "tags": doc.get("tags", [])
+        })
+    return results
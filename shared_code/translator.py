@@ -0,0 +1,251 @@
+import asyncio
+from shared_code.cache import hash_key, normalize_text
+
+# Supported languages: English (en), Welsh (cy), Spanish (es), Tamil (ta), Chinese Simplified (zh-Hans), Arabic (ar)
+SUPPORTED_LANGUAGES = ['en', 'cy', 'es', 'ta', 'zh-Hans', 'ar']
+
+# Code point ranges of scripts that each belong to one supported language;
+# other text is guessed to be English
+SCRIPT_LANGUAGES = [
+    (0x0B80, 0x0BFF, 'ta'),
+    (0x0600, 0x06FF, 'ar'),
+    (0x4E00, 0x9FFF, 'zh-Hans'),
+]
+DEFAULT_LANGUAGE_GUESS = 'en'
+
+# Translator accepts up to 1000 texts per request, and at most 50,000 characters
+# counted once per target language, so requests are chunked against both.
+MAX_TEXTS_PER_REQUEST = 1000
+MAX_CHARACTERS_PER_REQUEST = 50000
+
+
+def _chunks(items, target_count, key=None):
+    """Split ``items`` greedily into request-sized lists for ``target_count`` target languages.
+
+    ``key`` maps an item to its text; by default the items are the texts.
+    """
+    chunk = []
+    characters = 0
+    for item in items:
+        text_characters = len(key(item) if key else item) * max(target_count, 1)
+        if chunk and (len(chunk) == MAX_TEXTS_PER_REQUEST
+                      or characters + text_characters > MAX_CHARACTERS_PER_REQUEST):
+            yield chunk
+            chunk = []
+            characters = 0
+        chunk.append(item)
+        characters += text_characters
+    if chunk:
+        yield chunk
+
+
+async def _translate(client, texts, source_language=None, target_languages=SUPPORTED_LANGUAGES, text_type=None):
+    """Send one /translate request for every text and every target language.
+
+    Repeated ``to=`` parameters make Translator return all target languages in a
+    single round trip. When ``source_language`` is omitted the service detects
+    the language and reports it as ``detectedLanguage`` on each result.
+    """
+    params = [("api-version", "3.0")]
+    if source_language:
+        params.append(("from", source_language))
+    params.extend(("to", target_lang) for target_lang in target_languages)
+    if text_type:
+        params.append(("textType", text_type))
+
+    body = [{'text': text} for text in texts]
+
+    return await client.post("translate", params=params, json=body)
+
+
+def guess_language(text):
+    """A free guess at the language of ``text`` from its script."""
+    for character in text:
+        code_point = ord(character)
+        for first, last, language in SCRIPT_LANGUAGES:
+            if first <= code_point <= last:
+                return language
+    return DEFAULT_LANGUAGE_GUESS
+
+
+async def detect_and_translate(client, text, target_languages=SUPPORTED_LANGUAGES):
+    """Detect the language of ``text`` and translate it in the same request.
+
+    Returns ``(language, score, translations)`` where ``translations`` maps each
+    target language other than the detected one to its translated text.
+
+    The language is not known until Translator answers, so the request leaves
+    out only the guess from ``guess_language``. When the guess is wrong, the
+    translation into the detected language is paid for and dropped, and the
+    guessed language is fetched in a second request.
+    """
+    detections = await detect_and_translate_many(client, [text], target_languages)
+    return detections[0]
+
+
+def _detection_result(result):
+    detected_language = result['detectedLanguage']['language']
+    confidence = result['detectedLanguage']['score']
+
+    translations = {
+        translation['to']: translation['text']
+        for translation in result['translations']
+        if translation['to'] != detected_language
+    }
+    return detected_language, confidence, translations
+
+
+async def detect_and_translate_many(client, texts, target_languages=SUPPORTED_LANGUAGES):
+    """Detect and translate several texts with as few requests as Translator's limits allow.
+
+    Texts are grouped by their guessed language, which is left out of their
+    targets as in ``detect_and_translate``. Returns one
+    ``(language, score, translations)`` tuple per input text, in the same order.
+    """
+    indexes_by_guess = {}
+    for index, text in enumerate(texts):
+        guess = guess_language(text)
+        indexes_by_guess.setdefault(guess if guess in target_languages else None, []).append(index)
+
+    requests = [
+        (guess, chunk)
+        for guess, indexes in indexes_by_guess.items()
+        for chunk in _chunks(indexes, len(target_languages) - (guess is not None), key=lambda index: texts[index])
+    ]
+    responses = await asyncio.gather(*(
+        _translate(client, [texts[index] for index in chunk],
+                   target_languages=[lang for lang in target_languages if lang != guess])
+        for guess, chunk in requests
+    ))
+
+    detections = [None] * len(texts)
+    # Texts whose guess was wrong, by (detected language, guess)
+    missing = {}
+    for (guess, chunk), results in zip(requests, responses):
+        for index, result in zip(chunk, results):
+            detections[index] = _detection_result(result)
+            detected_language = detections[index][0]
+            if guess is not None and guess != detected_language:
+                missing.setdefault((detected_language, guess), []).append(index)
+
+    fetched = await asyncio.gather(*(
+        translate_many(client, [texts[index] for index in indexes], detected_language, [guess])
+        for (detected_language, guess), indexes in missing.items()
+    ))
+    for indexes, translations in zip(missing.values(), fetched):
+        for index, translation in zip(indexes, translations):
+            detections[index][2].update(translation)
+    return detections
+
+
+async def translate(client, text, source_language, target_languages=SUPPORTED_LANGUAGES, text_type=None):
+    """Translate ``text`` from ``source_language`` to every other target language."""
+    targets = [lang for lang in target_languages if lang != source_language]
+    results = await _translate(client, [text], source_language=source_language, target_languages=targets,
+                               text_type=text_type)
+    result = results[0]
+
+    return {translation['to']: translation['text'] for translation in result['translations']}
+
+
+async def translate_many(client, texts, source_language, target_languages=SUPPORTED_LANGUAGES):
+    """Translate several texts from ``source_language`` using as few requests as possible.
+
+    Returns one ``{language: text}`` dict per input text, in the same order.
+    """
+    targets = [lang for lang in target_languages if lang != source_language]
+    results = []
+    for chunk in _chunks(texts, len(targets)):
+        for result in await _translate(client, chunk, source_language=source_language, target_languages=targets):
+            results.append({translation['to']: translation['text'] for translation in result['translations']})
+    return results
+
+
+def _detection_key(text):
+    return hash_key("detect", normalize_text(text, casefold=False))
+
+
+def _translation_key(text, source_language, target_language, text_type=None):
+    return hash_key("translate", text_type or "plain", normalize_text(text, casefold=False),
+                    source_language, target_language)
+
+
+async def cached_translate(client, text, source_language, cache, target_languages=SUPPORTED_LANGUAGES, text_type=None):
+    """Like ``translate``, but only languages missing from ``cache`` are sent to Translator."""
+    keys = {
+        target_lang: _translation_key(text, source_language, target_lang, text_type)
+        for target_lang in target_languages if target_lang != source_language
+    }
+    found = await cache.get_many(list(keys.values()))
+    translations = {target_lang: found[key] for target_lang, key in keys.items() if key in found}
+
+    missing = [target_lang for target_lang in keys if target_lang not in translations]
+    if missing:
+        fresh = await translate(client, text, source_language, missing, text_type=text_type)
+        await cache.set_many({keys[target_lang]: translated for target_lang, translated in fresh.items()})
+        translations.update(fresh)
+    return translations
+
+
+async def cached_detect_and_translate(client, text, cache, target_languages=SUPPORTED_LANGUAGES):
+    """Like ``detect_and_translate``, reusing cached detections and translations.
+
+    A fully cached text needs no Translator call at all.
+    """
+    detection_key = _detection_key(text)
+    detection = await cache.get(detection_key)
+
+    if detection is None:
+        detected_language, confidence, translations = await detect_and_translate(client, text, target_languages)
+        await cache.set_many(_detection_cache_values(text, detected_language, confidence, translations))
+        return detected_language, confidence, translations
+
+    detected_language, confidence = detection
+    translations = await cached_translate(client, text, detected_language, cache, target_languages)
+    return detected_language, confidence, translations
+
+
+def _detection_cache_values(text, detected_language, confidence, translations):
+    values = {
+        _translation_key(text, detected_language, target_lang): translated
+        for target_lang, translated in translations.items()
+    }
+    values[_detection_key(text)] = [detected_language, confidence]
+    return values
+
+
+async def cached_detect_and_translate_many(client, texts, cache, target_languages=SUPPORTED_LANGUAGES):
+    """Like ``detect_and_translate_many``, reusing cached detections and translations.
+
+    Texts never seen before are sent together in array requests; texts that
+    were detected before only fetch the translations missing from the cache.
+    """
+    unique_texts = list(dict.fromkeys(texts))
+    detection_keys = {text: _detection_key(text) for text in unique_texts}
+    detections = await cache.get_many(list(detection_keys.values()))
+
+    results = {}
+    uncached = [text for text in unique_texts if detection_keys[text] not in detections]
+    if uncached:
+        values = {}
+        for text, result in zip(uncached, await detect_and_translate_many(client, uncached, target_languages)):
+            results[text] = result
+            values.update(_detection_cache_values(text, *result))
+        await cache.set_many(values)
+
+    cached = [text for text in unique_texts if text not in results]
+    cached_results = await asyncio.gather(*(
+        cached_detect_and_translate(client, text, cache, target_languages) for text in cached
+    ))
+    results.update(zip(cached, cached_results))
+
+    return [results[text] for text in texts]
+
+
+def build_texts(text, language, translations, target_languages=SUPPORTED_LANGUAGES):
+    """Build the ``texts`` list stored on a prompt: original first, then each translation."""
+    texts = [{"text": text, "language": language}]
+    for target_lang in target_languages:
+        if target_lang in translations:
+            texts.append({"text": translations[target_lang], "language": target_lang})
+    return texts
@@ -0,0 +1,141 @@
+import asyncio
+import html
+import json
+import logging
+import os
+import re
+from azure.cosmos import exceptions
+from shared_code import translator
+
+WELCOME_TEXT = "Welcome to COMP3207, {username}"
+
+# The welcome sentence is translated once with the username protected from
+# translation, then each registration only substitutes its username.
+USERNAME_PLACEHOLDER = "{username}"
+WELCOME_TEMPLATE_HTML = 'Welcome to COMP3207, <span class="notranslate">{username}</span>'
+NOTRANSLATE_SPAN = re.compile(r'<span[^>]*class="notranslate"[^>]*>\s*\{username\}\s*</span>')
+
+_templates = None
+_templates_lock = asyncio.Lock()
+
+WELCOME_CONCURRENCY = int(os.environ.get("WelcomeConcurrency", "8"))
+
+_semaphore = asyncio.Semaphore(WELCOME_CONCURRENCY)
+
+
+def welcome_prompt_id(username):
+    """Deterministic id of a player's welcome prompt, so creating it is idempotent."""
+    return f"welcome-{username}"
+
+
+async def welcome_prompt_exists(container, username):
+    try:
+        async with _semaphore:
+            await container.read_item(item=welcome_prompt_id(username), partition_key=username)
+        return True
+    except exceptions.CosmosResourceNotFoundError:
+        return False
+
+
+async def _load_templates(translator_client, translation_cache):
+    """Translate the welcome template into every supported language.
+
+    Templates can be pinned with the ``WelcomeTemplates`` setting (a JSON
+    object of language to template), otherwise they come from the shared
+    translation cache or one Translator request. Returns ``None`` if a
+    translation lost the username placeholder.
+    """
+    pinned_templates = os.environ.get("WelcomeTemplates")
+    if pinned_templates:
+        return json.loads(pinned_templates)
+
+    translations = await translator.cached_translate(
+        translator_client, WELCOME_TEMPLATE_HTML, "en", translation_cache, text_type="html")
+
+    templates = {"en": WELCOME_TEXT}
+    for language, translated in translations.items():
+        template, replaced = NOTRANSLATE_SPAN.subn(USERNAME_PLACEHOLDER, translated)
+        if replaced != 1:
+            logging.warning(f"Welcome template for {language} lost its username placeholder")
+            return None
+        templates[language] = html.unescape(template)
+    return templates
+
+
+async def get_templates(translator_client, translation_cache):
+    """Return the welcome templates, translating them on first use in this process.
+
+    Returns ``None`` when no usable templates exist; a template that lost its
+    placeholder is not retried, a failed request is retried on the next batch.
+    """
+    global _templates
+    if _templates is None:
+        async with _templates_lock:
+            if _templates is None:
+                try:
+                    _templates = await _load_templates(translator_client, translation_cache) or False
+                except Exception as e:
+                    logging.warning(f"Error translating welcome templates: {str(e)}")
+                    return None
+    return _templates or None
+
+
+async def _create_welcome_prompt(container, username, texts):
+    welcome_prompt = {
+        "id": welcome_prompt_id(username),
+        "username": username,
+        "texts": texts,
+        "tags": [],
+        "tags_lower": []
+    }
+    try:
+        async with _semaphore:
+            await container.create_item(body=welcome_prompt)
+        logging.info(f"Welcome prompt created for user: {username}")
+        return True
+    except exceptions.CosmosResourceExistsError:
+        logging.info(f"Welcome prompt already exists for user: {username}, skipping creation")
+        return False
+
+
+async def create_welcome_prompts(container, translator_client, translation_cache, usernames):
+    """Create welcome prompts for a batch of new players.
+
+    Existing welcome prompts are found with concurrent point reads, the
+    remaining welcome texts are filled in from the translated templates (or
+    translated together if no usable template exists) and the prompts are
+    written concurrently. Returns the number of prompts created, or raises
+    the first error once every write has finished so the batch can be retried.
+    """
+    usernames = list(dict.fromkeys(usernames))
+    exists = await asyncio.gather(*(welcome_prompt_exists(container, username) for username in usernames))
+    usernames = [username for username, found in zip(usernames, exists) if not found]
+    if len(usernames) == 0:
+        return 0
+
+    welcome_texts = [WELCOME_TEXT.replace(USERNAME_PLACEHOLDER, username) for username in usernames]
+
+    templates = await get_templates(translator_client, translation_cache)
+    if templates is not None:
+        translations = [
+            {language: template.replace(USERNAME_PLACEHOLDER, username)
+             for language, template in templates.items() if language != "en"}
+            for username in usernames
+        ]
+    else:
+        translations = await translator.translate_many(translator_client, welcome_texts, "en")
+
+    async def create(username, welcome_text, welcome_translations):
+        try:
+            texts = translator.build_texts(welcome_text, "en", welcome_translations)
+            return await _create_welcome_prompt(container, username, texts)
+        except Exception as e:
+            logging.error(f"Error creating welcome prompt for {username}: {str(e)}")
+            raise
+
+    created = await asyncio.gather(
+        *(create(*args) for args in zip(usernames, welcome_texts, translations)), return_exceptions=True)
+    errors = [outcome for outcome in created if isinstance(outcome, Exception)]
+    if errors:
+        raise errors[0]
+    return sum(1 for was_created in created if was_created)